@@ -1,13 +1,17 @@
 import numpy as np
-from lasagne.layers import Layer, ElemwiseMergeLayer, LSTMLayer, Gate
-from lasagne.init import Normal
+from lasagne.layers import Layer, MergeLayer, ElemwiseMergeLayer, LSTMLayer, Gate
+from lasagne.init import Normal, GlorotUniform, Constant
+from lasagne.nonlinearities import rectify, tanh
 from lasagne.utils import unroll_scan
 import theano.tensor as T
 import theano
 import utils.signal
 
+LSTM_GATES = ['ingate', 'forgetgate', 'cell', 'outgate']
 
-def create_lstm(l_incoming, l_mask, hidden_units, cell_parameters, gate_parameters, name, use_peepholes=False):
+
+def create_lstm(l_incoming, l_mask, hidden_units, cell_parameters, gate_parameters, name, use_peepholes=False,
+                unroll_scan=False):
     if cell_parameters is None:
         cell_parameters = Gate()
     if gate_parameters is None:
@@ -21,12 +25,12 @@ def create_lstm(l_incoming, l_mask, hidden_units, cell_parameters, gate_paramete
         ingate=gate_parameters, forgetgate=gate_parameters,
         cell=cell_parameters, outgate=gate_parameters,
         # We'll learn the initialization and use gradient clipping
-        learn_init=True, grad_clipping=5., name=name)
+        learn_init=True, grad_clipping=5., name=name, unroll_scan=unroll_scan)
     return l_lstm
 
 
 def create_pretrained_lstm(lstm_weights, prefix, l_incoming, l_mask, hidden_units, cell_parameters, gate_parameters,
-                           name, use_peepholes=False, backwards=False):
+                           name, use_peepholes=False, backwards=False, unroll_scan=False):
     l_lstm = LSTMLayer(
         l_incoming, hidden_units, peepholes=use_peepholes,
         # We need to specify a separate input for masks
@@ -35,24 +39,30 @@ def create_pretrained_lstm(lstm_weights, prefix, l_incoming, l_mask, hidden_unit
         ingate=gate_parameters, forgetgate=gate_parameters,
         cell=cell_parameters, outgate=gate_parameters,
         # We'll learn the initialization and use gradient clipping
-        learn_init=True, grad_clipping=5., name=name, backwards=backwards)
-
-    l_lstm.W_hid_to_cell.container.data = lstm_weights['{}_w_hid_to_cell'.format(prefix)].astype('float32')
-    l_lstm.W_hid_to_forgetgate.container.data = lstm_weights['{}_w_hid_to_forgetgate'.format(prefix)].astype('float32')
-    l_lstm.W_hid_to_ingate.container.data = lstm_weights['{}_w_hid_to_ingate'.format(prefix)].astype('float32')
-    l_lstm.W_hid_to_outgate.container.data = lstm_weights['{}_w_hid_to_outgate'.format(prefix)].astype('float32')
-    l_lstm.W_in_to_cell.container.data = lstm_weights['{}_w_in_to_cell'.format(prefix)].astype('float32')
-    l_lstm.W_in_to_forgetgate.container.data = lstm_weights['{}_w_in_to_forgetgate'.format(prefix)].astype('float32')
-    l_lstm.W_in_to_ingate.container.data = lstm_weights['{}_w_in_to_ingate'.format(prefix)].astype('float32')
-    l_lstm.W_in_to_outgate.container.data = lstm_weights['{}_w_in_to_outgate'.format(prefix)].astype('float32')
-    l_lstm.b_cell.container.data = lstm_weights['{}_b_cell'.format(prefix)].astype('float32').reshape((-1,))
-    l_lstm.b_forgetgate.container.data = lstm_weights['{}_b_forgetgate'.format(prefix)].astype('float32').reshape((-1,))
-    l_lstm.b_ingate.container.data = lstm_weights['{}_b_ingate'.format(prefix)].astype('float32').reshape((-1,))
-    l_lstm.b_outgate.container.data = lstm_weights['{}_b_outgate'.format(prefix)].astype('float32').reshape((-1,))
+        learn_init=True, grad_clipping=5., name=name, backwards=backwards, unroll_scan=unroll_scan)
+
+    load_lstm_weights(l_lstm, lstm_weights, prefix)
     return l_lstm
 
 
-def create_blstm(l_incoming, l_mask, hidden_units, cell_parameters, gate_parameters, name, use_peepholes=False):
+def load_lstm_weights(lstm, lstm_weights, prefix):
+    """
+    set the parameters of an lstm to pre-trained weights
+    :param lstm: LSTMLayer or LSTMParams of one stream of a MultiStreamLSTMLayer
+    :param lstm_weights: dictionary of weights, see deltanet_majority_vote.extract_lstm_weights
+    :param prefix: prefix of the weight names, e.g. 'f_lstm'
+    """
+    for gate in LSTM_GATES:
+        getattr(lstm, 'W_hid_to_{}'.format(gate)).container.data = \
+            lstm_weights['{}_w_hid_to_{}'.format(prefix, gate)].astype('float32')
+        getattr(lstm, 'W_in_to_{}'.format(gate)).container.data = \
+            lstm_weights['{}_w_in_to_{}'.format(prefix, gate)].astype('float32')
+        getattr(lstm, 'b_{}'.format(gate)).container.data = \
+            lstm_weights['{}_b_{}'.format(prefix, gate)].astype('float32').reshape((-1,))
+
+
+def create_blstm(l_incoming, l_mask, hidden_units, cell_parameters, gate_parameters, name, use_peepholes=False,
+                 unroll_scan=False):
 
     if cell_parameters is None:
         cell_parameters = Gate()
@@ -67,7 +77,7 @@ def create_blstm(l_incoming, l_mask, hidden_units, cell_parameters, gate_paramet
         ingate=gate_parameters, forgetgate=gate_parameters,
         cell=cell_parameters, outgate=gate_parameters,
         # We'll learn the initialization and use gradient clipping
-        learn_init=True, grad_clipping=5., name='f_{}'.format(name))
+        learn_init=True, grad_clipping=5., name='f_{}'.format(name), unroll_scan=unroll_scan)
 
     # The "backwards" layer is the same as the first,
     # except that the backwards argument is set to True.
@@ -75,11 +85,41 @@ def create_blstm(l_incoming, l_mask, hidden_units, cell_parameters, gate_paramet
         l_incoming, hidden_units, ingate=gate_parameters, peepholes=use_peepholes,
         mask_input=l_mask, forgetgate=gate_parameters,
         cell=cell_parameters, outgate=gate_parameters,
-        learn_init=True, grad_clipping=5., backwards=True, name='b_{}'.format(name))
+        learn_init=True, grad_clipping=5., backwards=True, name='b_{}'.format(name), unroll_scan=unroll_scan)
 
     return l_lstm, l_lstm_back
 
 
+def create_fused_blstm(l_incoming, l_mask, hidden_units, cell_parameters, gate_parameters, name,
+                       use_peepholes=False, unroll_scan=False):
+    """
+    create a blstm running both directions in one scan, the output is the sum of the forward and
+    backward lstm outputs, like the ElemwiseSumLayer over the layers of create_blstm
+    """
+    if cell_parameters is None:
+        cell_parameters = Gate()
+    if gate_parameters is None:
+        gate_parameters = Gate()
+
+    return BidirectionalLSTMLayer(
+        l_incoming, hidden_units, peepholes=use_peepholes, mask_input=l_mask,
+        ingate=gate_parameters, forgetgate=gate_parameters,
+        cell=cell_parameters, outgate=gate_parameters,
+        learn_init=True, grad_clipping=5., name=name, unroll_scan=unroll_scan)
+
+
+def create_pretrained_blstm(lstm_weights, l_incoming, l_mask, hidden_units, cell_parameters, gate_parameters,
+                            name, use_peepholes=False, unroll_scan=False):
+    """
+    create a fused blstm initialised with the pre-trained f_lstm and b_lstm weights
+    """
+    l_blstm = create_fused_blstm(l_incoming, l_mask, hidden_units, cell_parameters, gate_parameters, name,
+                                 use_peepholes, unroll_scan)
+    load_lstm_weights(l_blstm.forward, lstm_weights, 'f_lstm')
+    load_lstm_weights(l_blstm.backward, lstm_weights, 'b_lstm')
+    return l_blstm
+
+
 class ZNormalizeLayer(Layer):
     """
        Layer to z-normalize to input sequence,
@@ -107,11 +147,24 @@ class DeltaLayer(Layer):
     Layer to add delta coefficients to input sequence,
     Appends 1st and 2nd order delta and acceleration coefficients to input sequence
     """
-    def __init__(self, incoming, window, **kwargs):
+    def __init__(self, incoming, window, method='matrix', **kwargs):
+        """
+        Constructs a Delta layer
+        :param incoming: incoming layer
+        :param window: window size for computing the delta coefficients
+        :param method: 'matrix' applies a closed-form delta operator to the whole batch,
+                       'scan' uses the original per-sequence theano.scan implementation
+        :param kwargs: arguments to pass down
+        """
         super(DeltaLayer, self).__init__(incoming, **kwargs)
+        if method not in ('matrix', 'scan'):
+            raise ValueError("method must be 'matrix' or 'scan', got {}".format(method))
         self.window = window
+        self.method = method
 
     def get_output_for(self, input, **kwargs):
+        if self.method == 'matrix':
+            return utils.signal.append_delta_coeff_batch(input, self.window)
 
         # compute delta coefficients for multiple sequences
         res, _ = theano.scan(utils.signal.append_delta_coeff, sequences=input, non_sequences=self.window)
@@ -121,6 +174,203 @@ class DeltaLayer(Layer):
         return input_shape[0], input_shape[1], input_shape[-1] * 3
 
 
+class LSTMParams(object):
+    """
+    Parameters of one lstm, with the attribute names of the LSTMLayer parameters
+    """
+    def __init__(self, layer, num_inputs, num_units, gates, peepholes, cell_init, hid_init, learn_init, prefix):
+        """
+        add the parameters of one lstm to a layer
+        :param layer: layer holding the parameters
+        :param num_inputs: number of inputs
+        :param num_units: number of hidden units
+        :param gates: ingate, forgetgate, cell and outgate Gate instances
+        :param peepholes: add peephole connections
+        :param cell_init: initializer of the initial cell state
+        :param hid_init: initializer of the initial hidden state
+        :param learn_init: learn the initial cell and hidden state
+        :param prefix: prefix of the parameter names
+        """
+        # same order as the LSTMLayer parameters, so saved two layer blstm models can be loaded
+        for gate, name in zip(gates, LSTM_GATES):
+            setattr(self, 'W_in_to_{}'.format(name), layer.add_param(
+                gate.W_in, (num_inputs, num_units), name='{}W_in_to_{}'.format(prefix, name)))
+            setattr(self, 'W_hid_to_{}'.format(name), layer.add_param(
+                gate.W_hid, (num_units, num_units), name='{}W_hid_to_{}'.format(prefix, name)))
+            setattr(self, 'b_{}'.format(name), layer.add_param(
+                gate.b, (num_units,), name='{}b_{}'.format(prefix, name), regularizable=False))
+        if peepholes:
+            for gate, name in zip(gates, LSTM_GATES):
+                if name != 'cell':
+                    setattr(self, 'W_cell_to_{}'.format(name), layer.add_param(
+                        gate.W_cell, (num_units,), name='{}W_cell_to_{}'.format(prefix, name)))
+        self.cell_init = layer.add_param(cell_init, (1, num_units), name='{}cell_init'.format(prefix),
+                                         trainable=learn_init, regularizable=False)
+        self.hid_init = layer.add_param(hid_init, (1, num_units), name='{}hid_init'.format(prefix),
+                                        trainable=learn_init, regularizable=False)
+
+    def stacked(self, kind):
+        """
+        :param kind: 'W_in_to', 'W_hid_to' or 'b'
+        :return: weights of the four gates concatenated along the unit axis
+        """
+        return T.concatenate([getattr(self, '{}_{}'.format(kind, name)) for name in LSTM_GATES], axis=-1)
+
+
+class MultiStreamLSTMLayer(MergeLayer):
+    """
+    Layer running one lstm per incoming layer in a single scan
+    Every stream lstm has its own parameters, the hidden to hidden products of all streams are
+    computed with one batched matmul per step. Backwards streams read a time reversed copy of
+    their input and mask. The output of shape (num_streams, num_examples, seqlen, num_units)
+    holds the output of every stream lstm, the same as the output of an LSTMLayer with the
+    stream parameters
+    """
+    def __init__(self, incomings, num_units, ingate=Gate(), forgetgate=Gate(),
+                 cell=Gate(W_cell=None, nonlinearity=tanh), outgate=Gate(), nonlinearity=tanh,
+                 cell_init=Constant(0.), hid_init=Constant(0.), learn_init=False, peepholes=True, grad_clipping=0,
+                 mask_input=None, backwards=None, stream_names=None, unroll_scan=False, **kwargs):
+        """
+        Constructs a Multi Stream LSTM layer, the remaining arguments are those of LSTMLayer
+        :param incomings: list of incoming layers of shape (num_examples, seqlen, num_inputs), one per stream
+        :param num_units: number of hidden units of each stream
+        :param mask_input: mask input layer of shape (num_examples, seqlen), shared by all streams
+        :param backwards: list of booleans, process the stream backwards
+        :param stream_names: list of stream lstm names, used to find the stream parameters,
+                             defaults to <layer name>_s1, ..., <layer name>_sN
+        :param unroll_scan: unroll the recurrence into a graph of seqlen steps instead of a scan,
+                            the sequence length of the incoming layers must be known
+        :param kwargs: arguments to pass down
+        """
+        num_streams = len(incomings)
+        incomings = list(incomings)
+        if mask_input is not None:
+            incomings.append(mask_input)
+        super(MultiStreamLSTMLayer, self).__init__(incomings, **kwargs)
+        self.nonlinearity = nonlinearity if nonlinearity is not None else (lambda x: x)
+        self.num_streams = num_streams
+        self.num_units = num_units
+        self.peepholes = peepholes
+        self.grad_clipping = grad_clipping
+        self.unroll_scan = unroll_scan
+        if unroll_scan and self.input_shapes[0][1] is None:
+            raise ValueError('the sequence length must be known to unroll the scan')
+        self.backwards = list(backwards) if backwards is not None else [False] * num_streams
+        if stream_names is None:
+            stream_names = ['{}_s{}'.format(self.name, i + 1) for i in range(num_streams)]
+        self.stream_names = list(stream_names)
+        self.gate_nonlinearities = [ingate.nonlinearity, forgetgate.nonlinearity,
+                                    cell.nonlinearity, outgate.nonlinearity]
+        gates = [ingate, forgetgate, cell, outgate]
+        # the parameters of every stream are added in LSTMLayer order, one stream after the other
+        self.streams = [LSTMParams(self, int(np.prod(shape[2:])), num_units, gates, peepholes, cell_init, hid_init,
+                                   learn_init, '{}.'.format(name))
+                        for shape, name in zip(self.input_shapes[:num_streams], self.stream_names)]
+
+    def get_output_shape_for(self, input_shapes):
+        return self.num_streams, input_shapes[0][0], input_shapes[0][1], self.num_units
+
+    def get_output_for(self, inputs, **kwargs):
+        # (seqlen, num_examples, num_inputs) inputs of every stream, time reversed for the backwards streams
+        stream_inputs = []
+        for input, backwards in zip(inputs[:self.num_streams], self.backwards):
+            if input.ndim > 3:
+                input = T.flatten(input, 3)
+            input = input.dimshuffle(1, 0, 2)
+            stream_inputs.append(input[::-1] if backwards else input)
+        num_batch = stream_inputs[0].shape[1]
+        num_units = self.num_units
+
+        # precompute the input projections of all streams, (seqlen, num_streams, num_examples, 4 * num_units)
+        projections = T.stack([T.dot(x, p.stacked('W_in_to')) + p.stacked('b')
+                               for x, p in zip(stream_inputs, self.streams)], axis=1)
+        # (num_streams, num_units, 4 * num_units)
+        W_hid_stacked = T.stack([p.stacked('W_hid_to') for p in self.streams])
+        if self.peepholes:
+            # (3, num_streams, 1, num_units) peephole weights of the in, forget and out gates
+            W_cell = T.stack([T.stack([getattr(p, 'W_cell_to_{}'.format(name)) for p in self.streams])
+                              for name in ['ingate', 'forgetgate', 'outgate']]).dimshuffle(0, 1, 'x', 2)
+        non_seqs = [W_hid_stacked, W_cell] if self.peepholes else [W_hid_stacked]
+
+        def step(input_n, cell_previous, hid_previous, W_hid_stacked, W_cell=None):
+            gates = input_n + T.batched_dot(hid_previous, W_hid_stacked)
+            if self.grad_clipping:
+                gates = theano.gradient.grad_clip(gates, -self.grad_clipping, self.grad_clipping)
+            ingate, forgetgate, cell_input, outgate = \
+                [gates[:, :, n * num_units:(n + 1) * num_units] for n in range(4)]
+            if self.peepholes:
+                ingate += cell_previous * W_cell[0]
+                forgetgate += cell_previous * W_cell[1]
+            ingate, forgetgate, cell_input = \
+                [f(g) for f, g in zip(self.gate_nonlinearities[:3], [ingate, forgetgate, cell_input])]
+            cell = forgetgate * cell_previous + ingate * cell_input
+            # the outgate peephole looks at the new cell, before the outgate nonlinearity
+            if self.peepholes:
+                outgate += cell * W_cell[2]
+            outgate = self.gate_nonlinearities[3](outgate)
+            hid = outgate * self.nonlinearity(cell)
+            return [cell, hid]
+
+        def step_masked(input_n, mask_n, cell_previous, hid_previous, W_hid_stacked, W_cell=None):
+            cell, hid = step(input_n, cell_previous, hid_previous, W_hid_stacked, W_cell)
+            # padded time steps keep the previous state
+            not_mask = 1 - mask_n
+            cell = cell * mask_n + cell_previous * not_mask
+            hid = hid * mask_n + hid_previous * not_mask
+            return [cell, hid]
+
+        if len(inputs) > self.num_streams:
+            mask = inputs[-1].dimshuffle(1, 0, 'x')
+            # (seqlen, num_streams, num_examples, 1)
+            sequences = [projections, T.stack([mask[::-1] if backwards else mask for backwards in self.backwards],
+                                              axis=1)]
+            step_fun = step_masked
+        else:
+            sequences = [projections]
+            step_fun = step
+
+        ones = T.ones((num_batch, 1))
+        cell_init = T.stack([T.dot(ones, p.cell_init) for p in self.streams])
+        hid_init = T.stack([T.dot(ones, p.hid_init) for p in self.streams])
+        if self.unroll_scan:
+            cell_out, hid_out = unroll_scan(fn=step_fun, sequences=sequences, outputs_info=[cell_init, hid_init],
+                                            non_sequences=non_seqs, n_steps=self.input_shapes[0][1])
+        else:
+            cell_out, hid_out = theano.scan(fn=step_fun, sequences=sequences, outputs_info=[cell_init, hid_init],
+                                            non_sequences=non_seqs, strict=True)[0]
+
+        # (num_streams, num_examples, seqlen, num_units), backwards outputs reversed back in time
+        return T.stack([hid_out[::-1, i] if backwards else hid_out[:, i]
+                        for i, backwards in enumerate(self.backwards)]).dimshuffle(0, 2, 1, 3)
+
+
+class BidirectionalLSTMLayer(MultiStreamLSTMLayer):
+    """
+    Layer running a forward and a backward lstm in a single scan
+    The output is the sum of the forward and backward outputs, the same as summing the
+    outputs of a forward and a backwards LSTMLayer with the same parameters
+    """
+    def __init__(self, incoming, num_units, **kwargs):
+        """
+        Constructs a Bidirectional LSTM layer, the arguments are those of LSTMLayer
+        :param incoming: incoming layer of shape (num_examples, seqlen, num_inputs)
+        :param num_units: number of hidden units of each direction
+        :param kwargs: arguments to pass down
+        """
+        name = kwargs.get('name')
+        super(BidirectionalLSTMLayer, self).__init__(
+            [incoming, incoming], num_units, backwards=[False, True],
+            stream_names=['f_{}'.format(name), 'b_{}'.format(name)], **kwargs)
+        self.forward, self.backward = self.streams
+
+    def get_output_shape_for(self, input_shapes):
+        return input_shapes[0][0], input_shapes[0][1], self.num_units
+
+    def get_output_for(self, inputs, **kwargs):
+        hid_out = super(BidirectionalLSTMLayer, self).get_output_for(inputs, **kwargs)
+        return hid_out[0] + hid_out[1]
+
+
 class MajorityVotingLayer(Layer):
     """
     Layer to compute the majority votes across multiple outputs
@@ -128,25 +378,27 @@ class MajorityVotingLayer(Layer):
     Casts a vote for each prediction and returns the combined votes as
     a single consolidated output
     """
-    def __init__(self, incoming, num_classes, **kwargs):
+    def __init__(self, incoming, num_classes, mask=None, **kwargs):
         """
         Constructs a Majority voting layer
         :param incoming: incoming layer
         :param num_classes: number of classification classes
+        :param mask: optional mask input layer, padded time steps do not vote
         :param kwargs: arguments to pass down
         """
         super(MajorityVotingLayer, self).__init__(incoming, **kwargs)
         self.num_classes = num_classes
+        self.mask = mask
 
     def get_output_for(self, input, **kwargs):
         s = input.shape
-        votes = T.zeros((s[0], s[-1]), dtype=input.dtype)
         a = T.argmax(input, axis=-1)
-        # for each class, count number of occurrences across all time steps
-        for idx in range(self.num_classes):
-            count = T.sum(T.eq(a, idx), axis=-1)
-            votes = T.set_subtensor(votes[:, idx], count)
-        return T.nnet.softmax(votes)
+        # one-hot encode the votes of all time steps and count them per class
+        votes = T.extra_ops.to_one_hot(a.flatten(), self.num_classes, dtype=input.dtype)
+        votes = votes.reshape((s[0], s[1], self.num_classes))
+        if self.mask is not None:
+            votes = votes * self.mask.input_var.dimshuffle(0, 1, 'x')
+        return T.nnet.softmax(votes.sum(axis=1))
 
     def get_output_shape_for(self, input_shape):
         return input_shape[0], input_shape[-1]
@@ -228,6 +480,91 @@ class AdaptiveElemwiseSumLayer(ElemwiseMergeLayer):
         return super(AdaptiveElemwiseSumLayer, self).get_output_for(inputs, **kwargs)
 
 
+class StackedDenseLayer(Layer):
+    """
+    Layer holding one fully connected layer per stack entry
+    Input of shape (num_stacks, num_examples, num_inputs) is multiplied with its own
+    (num_inputs, num_units) weight matrix per stack using a single batched matmul
+    """
+    def __init__(self, incoming, num_units, W=GlorotUniform(), b=Constant(0.), nonlinearity=rectify, **kwargs):
+        """
+        Constructs a Stacked Dense layer
+        :param incoming: incoming layer, the number of stacks must be known
+        :param num_units: number of output units of each stack
+        :param W: initial weights of shape (num_stacks, num_inputs, num_units)
+        :param b: initial biases of shape (num_stacks, num_units)
+        :param nonlinearity: nonlinearity applied to the output of every stack
+        :param kwargs: arguments to pass down
+        """
+        super(StackedDenseLayer, self).__init__(incoming, **kwargs)
+        self.nonlinearity = nonlinearity if nonlinearity is not None else (lambda x: x)
+        self.num_units = num_units
+        num_stacks = self.input_shape[0]
+        num_inputs = self.input_shape[-1]
+        self.W = self.add_param(W, (num_stacks, num_inputs, num_units), name='W')
+        self.b = self.add_param(b, (num_stacks, num_units), name='b', regularizable=False)
+
+    def get_output_for(self, input, **kwargs):
+        activation = T.batched_dot(input, self.W) + self.b.dimshuffle(0, 'x', 1)
+        return self.nonlinearity(activation)
+
+    def get_output_shape_for(self, input_shape):
+        return input_shape[0], input_shape[1], self.num_units
+
+
+class PackFramesLayer(Layer):
+    """
+    Layer to gather the valid frames of a padded batch into a dense matrix
+    Input of shape (num_examples, seqlen, num_inputs) becomes (num_valid_frames + 1, num_inputs),
+    the extra last row is a zero frame standing in for all padded frames, see UnpackFramesLayer
+    """
+    def __init__(self, incoming, mask, **kwargs):
+        """
+        Constructs a Pack Frames layer
+        :param incoming: incoming layer of shape (num_examples, seqlen, num_inputs)
+        :param mask: mask input layer of shape (num_examples, seqlen), nonzero for valid frames
+        :param kwargs: arguments to pass down
+        """
+        super(PackFramesLayer, self).__init__(incoming, **kwargs)
+        self.mask = mask
+
+    def get_output_for(self, input, **kwargs):
+        frames = input.reshape((-1, input.shape[-1]))
+        valid = T.flatnonzero(self.mask.input_var.flatten())
+        return T.concatenate([frames[valid], T.zeros_like(frames[:1])], axis=0)
+
+    def get_output_shape_for(self, input_shape):
+        return None, input_shape[-1]
+
+
+class UnpackFramesLayer(Layer):
+    """
+    Layer to scatter packed frames back into a padded batch, the inverse of PackFramesLayer
+    Input of shape (num_valid_frames + 1, num_units) becomes (num_examples, seqlen, num_units).
+    Padded frames take the last row, the output of the zero frame, so frame-wise layers between
+    the pack and unpack layers give the same result as on the padded batch of zero padded inputs
+    """
+    def __init__(self, incoming, mask, **kwargs):
+        """
+        Constructs an Unpack Frames layer
+        :param incoming: incoming layer of shape (num_valid_frames + 1, num_units)
+        :param mask: mask input layer of shape (num_examples, seqlen), nonzero for valid frames
+        :param kwargs: arguments to pass down
+        """
+        super(UnpackFramesLayer, self).__init__(incoming, **kwargs)
+        self.mask = mask
+
+    def get_output_for(self, input, **kwargs):
+        mask = self.mask.input_var
+        valid = T.neq(mask.flatten(), 0)
+        # row of every frame in the packed matrix, padded frames point to the zero frame row
+        rows = T.switch(valid, T.cumsum(T.cast(valid, 'int64')) - 1, input.shape[0] - 1)
+        return input[rows].reshape((mask.shape[0], mask.shape[1], input.shape[-1]))
+
+    def get_output_shape_for(self, input_shape):
+        return self.mask.output_shape[0], self.mask.output_shape[1], input_shape[-1]
+
+
 def test_vote():
     a = [[[1,2,3],[1,2,3],[1,2,3]],
          [[1,3,1],[1,3,1],[1,3,1]],
@@ -244,3 +581,30 @@ def test_vote():
             votes[i][idx] = count
 
     return votes
+
+
+def test_fused_blstm(num_inputs=4, num_units=5, seqlen=6):
+    """
+    check that a fused blstm computes the same output as a forward and a backwards LSTMLayer
+    with the same weights, peepholes included
+    """
+    from lasagne.layers import InputLayer, get_output, get_all_params
+    input = T.tensor3('input')
+    mask = T.matrix('mask')
+    l_in = InputLayer((None, seqlen, num_inputs), input)
+    l_mask = InputLayer((None, seqlen), mask)
+    f_lstm, b_lstm = create_blstm(l_in, l_mask, num_units, Gate(W_cell=None, nonlinearity=tanh), Gate(), 'lstm',
+                                  use_peepholes=True)
+    l_blstm = create_fused_blstm(l_in, l_mask, num_units, Gate(W_cell=None, nonlinearity=tanh), Gate(), 'lstm',
+                                 use_peepholes=True)
+    # LSTMParams use the attribute names of the LSTMLayer parameters
+    for lstm, params in [(f_lstm, l_blstm.forward), (b_lstm, l_blstm.backward)]:
+        for attr, param in vars(params).items():
+            param.set_value(getattr(lstm, attr).get_value())
+    assert len(get_all_params(l_blstm)) == len(get_all_params([f_lstm, b_lstm]))
+
+    fn = theano.function([input, mask], [get_output(f_lstm) + get_output(b_lstm), get_output(l_blstm)])
+    x = np.random.randn(3, seqlen, num_inputs).astype(theano.config.floatX)
+    m = (np.arange(seqlen) < np.array([[seqlen], [seqlen // 2], [1]])).astype(theano.config.floatX)
+    expected, output = fn(x, m)
+    assert np.allclose(expected, output, atol=1e-5)
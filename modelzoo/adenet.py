@@ -0,0 +1,331 @@
+import numpy as np
+import theano.tensor as T
+
+import lasagne as las
+from lasagne.layers import InputLayer, LSTMLayer, DenseLayer, ConcatLayer, ReshapeLayer, ElemwiseSumLayer
+from lasagne.layers import Gate, DropoutLayer, SliceLayer
+from lasagne.nonlinearities import tanh
+
+from custom.layers import DeltaLayer, AdaptiveElemwiseSumLayer, StackedDenseLayer, PackFramesLayer, \
+    UnpackFramesLayer, MultiStreamLSTMLayer, create_blstm, create_fused_blstm, create_pretrained_lstm, \
+    create_pretrained_blstm, load_lstm_weights
+from modelzoo.pretrained_encoder import create_pretrained_encoder
+
+ENCODER_NAMES = ['fc1', 'fc2', 'fc3', 'bottleneck']
+
+
+def can_stack_encoders(aes, shapes):
+    """
+    check if the encoders of all streams can be evaluated as one stacked encoder
+    :param aes: list of (weights, biases, shapes, nonlinearities) encoder tuples
+    :param shapes: list of stream input shapes
+    :return: True if all streams share input dimension, layer shapes and nonlinearities
+    """
+    if len(set(shape[-1] for shape in shapes)) != 1:
+        return False
+    layer_shapes = [tuple(ae[2]) for ae in aes]
+    nonlinearities = [tuple(ae[3]) for ae in aes]
+    return len(set(layer_shapes)) == 1 and len(set(nonlinearities)) == 1
+
+
+def create_stream_encoders(l_inputs, aes, shapes, win, stack_encoders=False, l_mask=None):
+    """
+    create the encoder -> reshape -> delta subgraph of every stream
+    :param l_inputs: list of stream input layers of shape (batchsize, seqlen, input_dim)
+    :param aes: list of (weights, biases, shapes, nonlinearities) encoder tuples
+    :param shapes: list of stream input shapes
+    :param win: window variable for the delta coefficients
+    :param stack_encoders: evaluate the encoders of all streams with one batched matmul per layer
+    :param l_mask: mask input layer, if given only the valid frames are encoded (padded frames must be zero)
+    :return: list of delta layers, one per stream
+    """
+    symbolic_batchsize = l_inputs[0].input_var.shape[0]
+    # a fixed sequence length stays in the output shapes, unrolled lstm layers need it
+    seqlen = l_inputs[0].shape[1] or l_inputs[0].input_var.shape[1]
+
+    if l_mask is not None:
+        # (num valid frames + 1, input_dim)
+        l_frames = [PackFramesLayer(l_in, l_mask, name='pack_s{}'.format(i + 1)) for i, l_in in enumerate(l_inputs)]
+    else:
+        l_frames = l_inputs
+
+    if stack_encoders and len(l_inputs) > 1 and can_stack_encoders(aes, shapes):
+        # (num_streams, frames, input_dim)
+        l_stack = ConcatLayer([ReshapeLayer(l_in, (1, -1, shape[-1]), name='reshape1_s{}'.format(i + 1))
+                               for i, (l_in, shape) in enumerate(zip(l_frames, shapes))], axis=0, name='stack')
+        weights, biases, layer_shapes, nonlinearities = aes[0]
+        l_encoder = l_stack
+        for j, num_units in enumerate(layer_shapes):
+            W = np.stack([ae[0][j] for ae in aes]).astype('float32')
+            b = np.stack([ae[1][j] for ae in aes]).astype('float32')
+            l_encoder = StackedDenseLayer(l_encoder, num_units, W=W, b=b, nonlinearity=nonlinearities[j],
+                                          name=ENCODER_NAMES[j])
+        l_encoders = [SliceLayer(l_encoder, i, axis=0, name='unstack_s{}'.format(i + 1))
+                      for i in range(len(l_inputs))]
+    else:
+        l_encoders = []
+        for i, (l_in, ae, shape) in enumerate(zip(l_frames, aes, shapes)):
+            weights, biases, layer_shapes, nonlinearities = ae
+            l_reshape1 = ReshapeLayer(l_in, (-1, shape[-1]), name='reshape1_s{}'.format(i + 1))
+            l_encoders.append(create_pretrained_encoder(l_reshape1, weights, biases, layer_shapes, nonlinearities,
+                                                        ['{}_s{}'.format(n, i + 1) for n in ENCODER_NAMES]))
+
+    l_deltas = []
+    for i, l_encoder in enumerate(l_encoders):
+        if l_mask is not None:
+            l_reshape2 = UnpackFramesLayer(l_encoder, l_mask, name='unpack_s{}'.format(i + 1))
+        else:
+            encoder_len = las.layers.get_output_shape(l_encoder)[-1]
+            l_reshape2 = ReshapeLayer(l_encoder,
+                                      (symbolic_batchsize, seqlen, encoder_len),
+                                      name='reshape2_s{}'.format(i + 1))
+        l_deltas.append(DeltaLayer(l_reshape2, win, name='delta_s{}'.format(i + 1)))
+    return l_deltas
+
+
+def create_pretrained_lstms(l_deltas, lstm_weights, l_mask, lstm_size, cell_parameters, gate_parameters,
+                            use_peepholes=True, use_blstm_substream=False, fuse_blstm=False, unroll_scan=False):
+    """
+    create the pre-trained lstm layers of every stream
+    :param l_deltas: list of delta layers, one per stream
+    :param lstm_weights: list of pre-trained lstm weights, one per stream
+    :param l_mask: mask input layer
+    :param lstm_size: number of lstm units
+    :param cell_parameters: cell Gate
+    :param gate_parameters: in, forget and out Gate
+    :param use_peepholes: use peepholes for the stream lstm layers
+    :param use_blstm_substream: sum a forward and backward pre-trained lstm for every stream
+    :param fuse_blstm: run both directions of the blstm substreams in one scan
+    :param unroll_scan: unroll the lstm recurrences instead of using scan
+    :return: list of stream output layers
+    """
+    l_lstms = []
+    for i, (l_delta, weights) in enumerate(zip(l_deltas, lstm_weights)):
+        if use_blstm_substream and fuse_blstm:
+            l_lstms.append(create_pretrained_blstm(weights, l_delta, l_mask, lstm_size, cell_parameters,
+                                                   gate_parameters, 'lstm_s{}'.format(i + 1), use_peepholes,
+                                                   unroll_scan))
+            continue
+        f_lstm = create_pretrained_lstm(weights, 'f_lstm', l_delta,
+                                        l_mask, lstm_size, cell_parameters, gate_parameters,
+                                        'f_lstm_s{}'.format(i + 1), use_peepholes, unroll_scan=unroll_scan)
+        if not use_blstm_substream:
+            l_lstms.append(f_lstm)
+            continue
+        b_lstm = create_pretrained_lstm(weights, 'b_lstm', l_delta,
+                                        l_mask, lstm_size, cell_parameters, gate_parameters,
+                                        'b_lstm_s{}'.format(i + 1), use_peepholes, backwards=True,
+                                        unroll_scan=unroll_scan)
+        l_lstms.append(ElemwiseSumLayer([f_lstm, b_lstm], name='sum_b_lstm_s{}'.format(i + 1)))
+    return l_lstms
+
+
+def create_pretrained_stream_lstms(l_deltas, lstm_weights, l_mask, lstm_size, cell_parameters, gate_parameters,
+                                   use_peepholes=True, use_blstm_substream=False, unroll_scan=False):
+    """
+    create the pre-trained lstms of all streams as one multi stream lstm layer
+    :param l_deltas: list of delta layers, one per stream
+    :param lstm_weights: list of pre-trained lstm weights, one per stream
+    :param l_mask: mask input layer
+    :param lstm_size: number of lstm units
+    :param cell_parameters: cell Gate
+    :param gate_parameters: in, forget and out Gate
+    :param use_peepholes: use peepholes for the stream lstm layers
+    :param use_blstm_substream: sum a forward and backward pre-trained lstm for every stream
+    :param unroll_scan: unroll the lstm recurrence instead of using scan
+    :return: list of stream output layers
+    """
+    directions = ['f', 'b'] if use_blstm_substream else ['f']
+    l_stream_lstms = MultiStreamLSTMLayer(
+        [l_delta for l_delta in l_deltas for _ in directions], lstm_size, peepholes=use_peepholes,
+        mask_input=l_mask, ingate=gate_parameters, forgetgate=gate_parameters,
+        cell=cell_parameters, outgate=gate_parameters, learn_init=True, grad_clipping=5.,
+        backwards=[d == 'b' for _ in l_deltas for d in directions],
+        stream_names=['{}_lstm_s{}'.format(d, i + 1) for i in range(len(l_deltas)) for d in directions],
+        unroll_scan=unroll_scan, name='lstm_streams')
+    for i, weights in enumerate(lstm_weights):
+        for j, d in enumerate(directions):
+            load_lstm_weights(l_stream_lstms.streams[i * len(directions) + j], weights, '{}_lstm'.format(d))
+
+    l_lstms = []
+    for i in range(len(l_deltas)):
+        l_directions = [SliceLayer(l_stream_lstms, i * len(directions) + j, axis=0,
+                                   name='unstack_{}_lstm_s{}'.format(d, i + 1)) for j, d in enumerate(directions)]
+        if use_blstm_substream:
+            l_lstms.append(ElemwiseSumLayer(l_directions, name='sum_b_lstm_s{}'.format(i + 1)))
+        else:
+            l_lstms.append(l_directions[0])
+    return l_lstms
+
+
+def create_fusion(l_streams, fusiontype):
+    """
+    fuse the outputs of the stream lstm layers
+    :param l_streams: list of stream output layers
+    :param fusiontype: 'concat', 'sum' or 'adasum'
+    :return: fusion layer
+    """
+    if fusiontype == 'adasum':
+        return AdaptiveElemwiseSumLayer(l_streams, name='adasum1')
+    elif fusiontype == 'sum':
+        return ElemwiseSumLayer(l_streams, name='sum1')
+    elif fusiontype == 'concat':
+        return ConcatLayer(l_streams, axis=-1, name='concat')
+    raise ValueError("fusiontype must be 'concat', 'sum' or 'adasum', got {}".format(fusiontype))
+
+
+def create_output(l_fuse, l_mask, symbolic_seqlen, lstm_size, output_classes, cell_parameters, gate_parameters,
+                  fuse_blstm=False, unroll_scan=False, use_peepholes=False):
+    if fuse_blstm:
+        l_sum2 = create_fused_blstm(l_fuse, l_mask, lstm_size, cell_parameters, gate_parameters, 'lstm_agg',
+                                    use_peepholes=use_peepholes, unroll_scan=unroll_scan)
+    else:
+        f_lstm_agg, b_lstm_agg = create_blstm(l_fuse, l_mask, lstm_size, cell_parameters, gate_parameters,
+                                              'lstm_agg', use_peepholes=use_peepholes, unroll_scan=unroll_scan)
+        l_sum2 = ElemwiseSumLayer([f_lstm_agg, b_lstm_agg], name='sum2')
+
+    # reshape to (num_examples * seq_len, lstm_size)
+    l_reshape3 = ReshapeLayer(l_sum2, (-1, lstm_size), name='reshape3')
+
+    # Now, we can apply feed-forward layers as usual.
+    # We want the network to predict a classification for the sequence,
+    # so we'll use a the number of classes.
+    l_softmax = DenseLayer(
+        l_reshape3, num_units=output_classes,
+        nonlinearity=las.nonlinearities.softmax, name='softmax')
+
+    return ReshapeLayer(l_softmax, (-1, symbolic_seqlen, output_classes), name='output')
+
+
+def create_gate_parameters(w_init_fn):
+    gate_parameters = Gate(
+        W_in=w_init_fn, W_hid=w_init_fn,
+        b=las.init.Constant(0.))
+    cell_parameters = Gate(
+        W_in=w_init_fn, W_hid=w_init_fn,
+        # Setting W_cell to None denotes that no cell connection will be used.
+        W_cell=None, b=las.init.Constant(0.),
+        # By convention, the cell nonlinearity is tanh in an LSTM.
+        nonlinearity=tanh)
+    return gate_parameters, cell_parameters
+
+
+def create_pretrained_model(streams, mask_shape, mask_var,
+                            lstm_size=250, win=T.iscalar('theta)'),
+                            output_classes=26, fusiontype='concat', w_init_fn=las.init.Orthogonal(),
+                            use_peepholes=True, use_blstm_substream=False, stack_encoders=False,
+                            pack_frames=False, fuse_blstm=False, fuse_stream_lstms=False, unroll_scan=False):
+    """
+    create a multi stream model with pre-trained encoders and stream lstm layers
+    :param streams: list of (ae, lstm, shape, var) tuples, one per stream
+    :param mask_shape: shape of the mask
+    :param mask_var: mask variable
+    :param lstm_size: number of lstm units
+    :param win: window variable for the delta coefficients
+    :param output_classes: number of output classes
+    :param fusiontype: 'concat', 'sum' or 'adasum'
+    :param w_init_fn: weight initialization function
+    :param use_peepholes: use peepholes for the stream lstm layers
+    :param use_blstm_substream: sum a forward and backward pre-trained lstm for every stream
+    :param stack_encoders: evaluate the encoders with one batched matmul when all streams share layer shapes
+    :param pack_frames: encode only the valid frames of the batch instead of all padded frames
+    :param fuse_blstm: run both directions of every blstm in one scan
+    :param fuse_stream_lstms: run the lstms of all streams in one scan
+    :param unroll_scan: unroll the lstm recurrences instead of using scan, the input shapes must
+                        have a fixed sequence length
+    :return: output layer, fusion layer
+    """
+    gate_parameters, cell_parameters = create_gate_parameters(w_init_fn)
+
+    l_inputs = [InputLayer(shape, var, 's{}_im'.format(i + 1)) for i, (ae, lstm, shape, var) in enumerate(streams)]
+    l_mask = InputLayer(mask_shape, mask_var, 'mask')
+    symbolic_seqlen = l_inputs[0].input_var.shape[1]
+
+    l_deltas = create_stream_encoders(l_inputs, [s[0] for s in streams], [s[2] for s in streams], win,
+                                      stack_encoders, l_mask if pack_frames else None)
+
+    if fuse_stream_lstms:
+        l_lstms = create_pretrained_stream_lstms(l_deltas, [s[1] for s in streams], l_mask, lstm_size,
+                                                 cell_parameters, gate_parameters, use_peepholes,
+                                                 use_blstm_substream, unroll_scan)
+    else:
+        l_lstms = create_pretrained_lstms(l_deltas, [s[1] for s in streams], l_mask, lstm_size,
+                                          cell_parameters, gate_parameters, use_peepholes,
+                                          use_blstm_substream, fuse_blstm, unroll_scan)
+
+    l_fuse = create_fusion(l_lstms, fusiontype)
+    l_out = create_output(l_fuse, l_mask, symbolic_seqlen, lstm_size, output_classes,
+                          cell_parameters, gate_parameters, fuse_blstm, unroll_scan)
+    return l_out, l_fuse
+
+
+def create_model(streams, mask_shape, mask_var,
+                 lstm_size=250, win=T.iscalar('theta)'),
+                 output_classes=26, fusiontype='concat', w_init_fn=las.init.Orthogonal(),
+                 use_peepholes=True, lstm2_size=None, use_dropout=False, stack_encoders=False,
+                 pack_frames=False, fuse_blstm=False, fuse_stream_lstms=False, unroll_scan=False):
+    """
+    create a multi stream model with pre-trained encoders and randomly initialised lstm layers
+    :param streams: list of (ae, shape, var) tuples, one per stream
+    :param mask_shape: shape of the mask
+    :param mask_var: mask variable
+    :param lstm_size: number of lstm units of the stream lstm layers, doubled when use_dropout is set
+    :param win: window variable for the delta coefficients
+    :param output_classes: number of output classes
+    :param fusiontype: 'concat', 'sum' or 'adasum'
+    :param w_init_fn: weight initialization function
+    :param use_peepholes: use peepholes for the stream lstm layers
+    :param lstm2_size: number of lstm units of the fusion blstm, defaults to the stream lstm size
+    :param use_dropout: apply dropout to the delta features and the fused features
+    :param stack_encoders: evaluate the encoders with one batched matmul when all streams share layer shapes
+    :param pack_frames: encode only the valid frames of the batch instead of all padded frames
+    :param fuse_blstm: run both directions of every blstm in one scan
+    :param fuse_stream_lstms: run the lstms of all streams in one scan
+    :param unroll_scan: unroll the lstm recurrences instead of using scan, the input shapes must
+                        have a fixed sequence length
+    :return: output layer, fusion layer
+    """
+    # the dropout model compensates for the dropped units with twice as wide stream lstms
+    stream_lstm_size = int(lstm_size) * 2 if use_dropout else int(lstm_size)
+    lstm2_size = stream_lstm_size if lstm2_size is None else lstm2_size
+    gate_parameters, cell_parameters = create_gate_parameters(w_init_fn)
+
+    l_inputs = [InputLayer(shape, var, 's{}_im'.format(i + 1)) for i, (ae, shape, var) in enumerate(streams)]
+    l_mask = InputLayer(mask_shape, mask_var, 'mask')
+    symbolic_seqlen = l_inputs[0].input_var.shape[1]
+
+    l_deltas = create_stream_encoders(l_inputs, [s[0] for s in streams], [s[1] for s in streams], win,
+                                      stack_encoders, l_mask if pack_frames else None)
+
+    if use_dropout:
+        l_deltas = [DropoutLayer(l_delta, name='dropout_s{}'.format(i + 1)) for i, l_delta in enumerate(l_deltas)]
+
+    if fuse_stream_lstms:
+        # one scan advancing the lstms of all streams, sliced back into one output per stream
+        l_stream_lstms = MultiStreamLSTMLayer(
+            l_deltas, stream_lstm_size, peepholes=use_peepholes, mask_input=l_mask,
+            ingate=gate_parameters, forgetgate=gate_parameters,
+            cell=cell_parameters, outgate=gate_parameters,
+            learn_init=True, grad_clipping=5., unroll_scan=unroll_scan, name='lstm_streams',
+            stream_names=['lstm_s{}'.format(i + 1) for i in range(len(l_deltas))])
+        l_lstms = [SliceLayer(l_stream_lstms, i, axis=0, name='unstack_lstm_s{}'.format(i + 1))
+                   for i in range(len(l_deltas))]
+    else:
+        l_lstms = []
+        for i, l_delta in enumerate(l_deltas):
+            l_lstms.append(LSTMLayer(
+                l_delta, stream_lstm_size, peepholes=use_peepholes,
+                # We need to specify a separate input for masks
+                mask_input=l_mask,
+                # Here, we supply the gate parameters for each gate
+                ingate=gate_parameters, forgetgate=gate_parameters,
+                cell=cell_parameters, outgate=gate_parameters,
+                # We'll learn the initialization and use gradient clipping
+                learn_init=True, grad_clipping=5., unroll_scan=unroll_scan, name='lstm_s{}'.format(i + 1)))
+
+    l_fuse = create_fusion(l_lstms, fusiontype)
+    l_agg_in = DropoutLayer(l_fuse, name='concat_dropout') if use_dropout else l_fuse
+    # the 2 stream model has always used peepholes in its fusion blstm, the 3 to 5 stream models have not
+    l_out = create_output(l_agg_in, l_mask, symbolic_seqlen, lstm2_size, output_classes,
+                          cell_parameters, gate_parameters, fuse_blstm, unroll_scan, len(streams) == 2)
+    return l_out, l_fuse
@@ -6,14 +6,16 @@ from lasagne.layers import Gate
 from lasagne.nonlinearities import tanh
 from lasagne.init import GlorotUniform
 
-from custom.layers import DeltaLayer, create_blstm, create_lstm
+from custom.layers import DeltaLayer, PackFramesLayer, UnpackFramesLayer, MultiStreamLSTMLayer, create_blstm, \
+    create_fused_blstm, create_lstm
 from modelzoo.pretrained_encoder import create_pretrained_encoder, create_encoder
 from utils.io import load_model_params
 
 
 def create_model(dbn, input_shape, input_var, mask_shape, mask_var,
                  lstm_size=250, win=T.iscalar('theta)'),
-                 output_classes=26, w_init_fn=GlorotUniform, use_peepholes=False, use_blstm=True):
+                 output_classes=26, w_init_fn=GlorotUniform, use_peepholes=False, use_blstm=True,
+                 pack_frames=False, fuse_blstm=False, unroll_scan=False):
 
     weights, biases, shapes, nonlinearities = dbn
 
@@ -32,19 +34,31 @@ def create_model(dbn, input_shape, input_var, mask_shape, mask_var,
 
     symbolic_batchsize = l_in.input_var.shape[0]
     symbolic_seqlen = l_in.input_var.shape[1]
+    # a fixed sequence length stays in the output shapes, unrolled lstm layers need it
+    seqlen = input_shape[1] or symbolic_seqlen
 
-    l_reshape1 = ReshapeLayer(l_in, (-1, input_shape[-1]), name='reshape1')
+    # with pack_frames only the valid frames are encoded, the padded frames must be zero
+    l_frames = PackFramesLayer(l_in, l_mask, name='pack') if pack_frames else l_in
+    l_reshape1 = ReshapeLayer(l_frames, (-1, input_shape[-1]), name='reshape1')
     l_encoder = create_pretrained_encoder(l_reshape1, weights, biases,
                                           shapes,
                                           nonlinearities,
                                           ['fc1', 'fc2', 'fc3', 'bottleneck'])
-    encoder_len = las.layers.get_output_shape(l_encoder)[-1]
-    l_reshape2 = ReshapeLayer(l_encoder, (symbolic_batchsize, symbolic_seqlen, encoder_len), name='reshape2')
+    if pack_frames:
+        l_reshape2 = UnpackFramesLayer(l_encoder, l_mask, name='unpack')
+    else:
+        encoder_len = las.layers.get_output_shape(l_encoder)[-1]
+        l_reshape2 = ReshapeLayer(l_encoder, (symbolic_batchsize, seqlen, encoder_len), name='reshape2')
     l_delta = DeltaLayer(l_reshape2, win, name='delta')
 
-    if use_blstm:
+    if use_blstm and fuse_blstm:
+        # one scan for both directions, the layer sums their outputs
+        l_sum1 = create_fused_blstm(l_delta, l_mask, lstm_size, cell_parameters, gate_parameters, 'blstm1',
+                                    use_peepholes, unroll_scan)
+        l_reshape3 = ReshapeLayer(l_sum1, (-1, lstm_size), name='reshape3')
+    elif use_blstm:
         l_lstm, l_lstm_back = create_blstm(l_delta, l_mask, lstm_size, cell_parameters, gate_parameters, 'blstm1',
-                                           use_peepholes)
+                                           use_peepholes, unroll_scan)
 
         # We'll combine the forward and backward layer output by summing.
         # Merge layers take in lists of layers to merge as input.
@@ -52,7 +66,8 @@ def create_model(dbn, input_shape, input_var, mask_shape, mask_var,
         # reshape, flatten to 2 dimensions to run softmax on all timesteps
         l_reshape3 = ReshapeLayer(l_sum1, (-1, lstm_size), name='reshape3')
     else:
-        l_lstm = create_lstm(l_delta, l_mask, lstm_size, cell_parameters, gate_parameters, 'lstm', use_peepholes)
+        l_lstm = create_lstm(l_delta, l_mask, lstm_size, cell_parameters, gate_parameters, 'lstm', use_peepholes,
+                             unroll_scan)
         l_reshape3 = ReshapeLayer(l_lstm, (-1, lstm_size), name='reshape3')
 
     # Now, we can apply feed-forward layers as usual.
@@ -68,7 +83,8 @@ def create_model(dbn, input_shape, input_var, mask_shape, mask_var,
 
 def load_saved_model(model_path, stream_params, input_shape, input_var, mask_shape, mask_var,
                      lstm_size=250, win=T.iscalar('theta)'),
-                     output_classes=26, w_init_fn=GlorotUniform(), use_peepholes=False, use_blstm=True):
+                     output_classes=26, w_init_fn=GlorotUniform(), use_peepholes=False, use_blstm=True,
+                     fuse_blstm=False):
     """
     loads a saved model
     :param model_path: path to model parameters
@@ -83,6 +99,8 @@ def load_saved_model(model_path, stream_params, input_shape, input_var, mask_sha
     :param output_classes: number of output classes
     :param w_init_fn: weight initialization function used for initializing model
     :param use_peepholes: use peepholes for lstm layers
+    :param use_blstm: use a blstm instead of a forward lstm
+    :param fuse_blstm: run both directions of the blstm in one scan, saved two layer blstm models load unchanged
     :return: saved model
     """
 
@@ -110,7 +128,11 @@ def load_saved_model(model_path, stream_params, input_shape, input_var, mask_sha
     l_reshape2 = ReshapeLayer(l_encoder, (symbolic_batchsize, symbolic_seqlen, encoder_len), name='reshape2')
     l_delta = DeltaLayer(l_reshape2, win, name='delta')
 
-    if use_blstm:
+    if use_blstm and fuse_blstm:
+        l_sum1 = create_fused_blstm(l_delta, l_mask, lstm_size, cell_parameters, gate_parameters, 'lstm',
+                                    use_peepholes)
+        l_reshape3 = ReshapeLayer(l_sum1, (-1, lstm_size), name='reshape3')
+    elif use_blstm:
         l_lstm, l_lstm_back = create_blstm(l_delta, l_mask, lstm_size, cell_parameters, gate_parameters, 'lstm',
                                            use_peepholes)
 
@@ -159,15 +181,21 @@ def extract_lstm_weights(network, names, saveas):
     """
     extract lstm weights of a given model
     :param network: trained model
-    :param names: names of lstm layer weights to extract
+    :param names: names of lstm layer weights to extract, the streams of a MultiStreamLSTMLayer are found
+                  by their stream names, e.g. f_lstm and b_lstm for the directions of a fused blstm named lstm
     :param saveas: names to save to in a list with prefix [prefix1, prefix2]
     :return: dictionary containing weights and biases of the lstm layers
     """
-    layers = las.layers.get_all_layers(network)
+    layers = []
+    for l in las.layers.get_all_layers(network):
+        if isinstance(l, MultiStreamLSTMLayer):
+            layers += list(zip(l.streams, l.stream_names))
+        else:
+            layers.append((l, l.name))
     d = {}
     for i, name in enumerate(names):
-        for l in layers:
-            if l.name == name:
+        for l, layer_name in layers:
+            if layer_name == name:
                 w_hid_to_cell = l.W_hid_to_cell.container.data
                 w_hid_to_forgetgate = l.W_hid_to_forgetgate.container.data
                 w_hid_to_ingate = l.W_hid_to_ingate.container.data
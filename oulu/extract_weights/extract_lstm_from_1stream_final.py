@@ -1,6 +1,7 @@
 # extract the lstm models out of the 1-stream pre-trained models
 # the pre-trained models will be placed in 'ip-avsr-release/oulu/results/1stream/best_models' after running 1stream experiments
-# usage: python extract_lstm_from_1stream_final.py
+# usage: python extract_lstm_from_1stream_final.py [<output name>.<run> ...]
+# without arguments the models of all views and runs are extracted
 
 from __future__ import print_function
 import sys
@@ -31,7 +32,16 @@ def parse_options(rt,modelName,outName,input_dim):
     return options
 
 
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('outputs', nargs='*',
+                        help='<output name>.<run> of the models to extract, e.g. 1stream_lstm_model_30.3, '
+                             'default all views and runs')
+    return parser.parse_args()
+
+
 def main():
+    args = parse_args()
 
     model = ['1stream_test',
              '1stream_test30',
@@ -52,6 +62,11 @@ def main():
            1320]
 
     runTime = 10
+    runs = range(1,runTime+1)
+    if args.outputs:
+        # only extract the requested models, the outputs of the other extraction script are ignored
+        runs = sorted(set(int(output.rsplit('.', 1)[1]) for output in args.outputs))
+    skipped = 0
 
 
     for n in range(len(model)):
@@ -60,9 +75,15 @@ def main():
         outName = out[n]
         input_dim = dim[n]
 
-        for rt in range(1,runTime+1):
+        for rt in runs:
+            if args.outputs and '{}.{}'.format(outName, rt) not in args.outputs:
+                continue
 
             options = parse_options(rt,modelName,outName,input_dim)
+            if not os.path.exists(options['input']):
+                print('skipping {}, {} does not exist'.format(options['output'], options['input']))
+                skipped += 1
+                continue
 
             print('Current options:')
             print(options)
@@ -96,6 +117,9 @@ def main():
                 print('save extracted weights to {}'.format(options['output']))
                 save_mat(d, options['output'])
 
+    if skipped:
+        sys.exit(1)
+
 
 if __name__ == '__main__':
     main()
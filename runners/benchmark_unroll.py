@@ -0,0 +1,120 @@
+"""
+Compares the scan and unrolled lstm recurrences of the multi-stream model.
+
+usage: python benchmark_unroll.py --streams 2 --seqlen 30 --batchsize 30
+
+Every mode is measured in a separate process, so the peak memory of one mode does not hide the other.
+The model is built with random encoder weights, the timings do not depend on the weight values.
+Reports the time to compile the training function, the mean time of a training step and the peak
+resident memory of the process.
+"""
+from __future__ import print_function
+import sys
+sys.path.insert(0, '../')
+import time
+import resource
+import argparse
+import subprocess
+
+import theano
+import theano.tensor as T
+import lasagne as las
+import numpy as np
+from lasagne.updates import adam
+
+from custom.objectives import temporal_softmax_loss
+from modelzoo import adenet
+
+MODES = ['scan', 'unroll']
+
+
+def random_encoder(inputdim, shapes):
+    """
+    :return: (weights, biases, shapes, nonlinearities) of an encoder with random weights, like load_decoder
+    """
+    dims = [inputdim] + shapes
+    weights = [np.random.randn(dims[i], dims[i + 1]).astype('float32') * 0.1 for i in range(len(shapes))]
+    biases = [np.zeros((dims[i + 1],), dtype='float32') for i in range(len(shapes))]
+    nonlinearities = [las.nonlinearities.rectify] * (len(shapes) - 1) + [las.nonlinearities.linear]
+    return weights, biases, shapes, nonlinearities
+
+
+def benchmark(mode, streams, seqlen, batchsize, inputdim, shapes, lstm_size, output_classes, steps):
+    """
+    build, compile and time the training function of one mode
+    :return: (compile time in sec, mean step time in sec, peak memory in MB)
+    """
+    unroll_scan = mode == 'unroll'
+    window = T.iscalar('theta')
+    inputs = [T.tensor3('inputs{}'.format(i + 1), dtype='float32') for i in range(streams)]
+    mask = T.matrix('mask', dtype='uint8')
+    targets = T.imatrix('targets')
+    shape = (None, seqlen if unroll_scan else None, inputdim)
+    mask_shape = (None, seqlen if unroll_scan else None)
+
+    network, _ = adenet.create_model([(random_encoder(inputdim, shapes), shape, var) for var in inputs],
+                                     mask_shape, mask, lstm_size, window, output_classes,
+                                     use_peepholes=True, unroll_scan=unroll_scan)
+    predictions = las.layers.get_output(network, deterministic=False)
+    all_params = las.layers.get_all_params(network, trainable=True)
+    cost = temporal_softmax_loss(predictions, targets, mask)
+    updates = adam(cost, all_params, learning_rate=0.0001)
+
+    start = time.time()
+    train = theano.function(inputs + [targets, mask, window], cost, updates=updates)
+    compile_time = time.time() - start
+
+    X = [np.random.rand(batchsize, seqlen, inputdim).astype('float32') for _ in range(streams)]
+    y = np.random.randint(0, output_classes, (batchsize, seqlen)).astype('int32')
+    m = np.ones((batchsize, seqlen), dtype='uint8')
+    train(*(X + [y, m, 2]))  # warm up
+    start = time.time()
+    for _ in range(steps):
+        train(*(X + [y, m, 2]))
+    step_time = (time.time() - start) / steps
+
+    # ru_maxrss is in kilobytes on linux
+    peak_memory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.
+    return compile_time, step_time, peak_memory
+
+
+def parse_options():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--streams', type=int, default=2, help='number of streams')
+    parser.add_argument('--seqlen', type=int, default=30, help='sequence length the lstms are unrolled to')
+    parser.add_argument('--batchsize', type=int, default=30, help='batch size of a training step')
+    parser.add_argument('--inputdim', type=int, default=1200, help='input dimensions of every stream')
+    parser.add_argument('--shape', default='2000,1000,500,50', help='encoder layer sizes')
+    parser.add_argument('--lstm_size', type=int, default=250, help='number of lstm units')
+    parser.add_argument('--output_classes', type=int, default=10, help='number of output classes')
+    parser.add_argument('--steps', type=int, default=10, help='number of timed training steps')
+    parser.add_argument('--mode', choices=MODES, help='measure a single mode and print its results as csv')
+    return parser.parse_args()
+
+
+def main():
+    options = parse_options()
+    theano.config.floatX = 'float32'
+    sys.setrecursionlimit(10000)
+
+    if options.mode:
+        shapes = [int(s) for s in options.shape.split(',')]
+        results = benchmark(options.mode, options.streams, options.seqlen, options.batchsize, options.inputdim,
+                            shapes, options.lstm_size, options.output_classes, options.steps)
+        print(','.join(str(r) for r in results))
+        return
+
+    print('{} streams, seqlen {}, batchsize {}'.format(options.streams, options.seqlen, options.batchsize))
+    print('{:8s} {:>12s} {:>12s} {:>12s}'.format('mode', 'compile(s)', 'step(ms)', 'memory(MB)'))
+    for mode in MODES:
+        args = [sys.executable, __file__, '--mode', mode]
+        for option in ['streams', 'seqlen', 'batchsize', 'inputdim', 'shape', 'lstm_size', 'output_classes',
+                       'steps']:
+            args += ['--' + option, str(getattr(options, option))]
+        output = subprocess.check_output(args).decode().strip().splitlines()[-1]
+        compile_time, step_time, peak_memory = [float(r) for r in output.split(',')]
+        print('{:8s} {:12.1f} {:12.1f} {:12.0f}'.format(mode, compile_time, step_time * 1000, peak_memory))
+
+
+if __name__ == '__main__':
+    main()
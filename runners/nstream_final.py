@@ -0,0 +1,698 @@
+from __future__ import print_function
+import os
+import sys
+sys.path.insert(0, '../')
+import re
+import time
+import ConfigParser
+import argparse
+
+import matplotlib
+matplotlib.use('Agg')  # Change matplotlib backend, in case we have no X server running..
+
+from utils.preprocessing import *
+from utils.plotting_utils import *
+from utils.data_structures import circular_list
+from utils.datagen import *
+from utils.io import *
+from utils.features import extract_features
+from utils.artifact_cache import ArtifactCache, array_digest
+from utils.evaluation import sequence_scores, confusion_matrix
+from utils.segments import segment_offsets, segment_chunks, segment_resize_index
+from utils.regularization import early_stop2
+from utils.function_cache import FunctionCache
+from custom.objectives import temporal_softmax_loss
+from custom.nonlinearities import select_nonlinearity
+
+import theano.tensor as T
+import theano
+
+import lasagne as las
+import numpy as np
+from lasagne.updates import adam
+
+from modelzoo import deltanet_majority_vote, adenet
+from utils.plotting_utils import print_network
+
+
+def load_decoder(path, shapes, nonlinearities):
+    nn = sio.loadmat(path)
+    weights = []
+    biases = []
+    shapes = [int(s) for s in shapes.split(',')]
+    nonlinearities = [select_nonlinearity(nonlinearity) for nonlinearity in nonlinearities.split(',')]
+    for i in range(len(shapes)):
+        weights.append(nn['w{}'.format(i+1)].astype('float32'))
+        biases.append(nn['b{}'.format(i+1)][0].astype('float32'))
+    return weights, biases, shapes, nonlinearities
+
+
+def configure_theano():
+    theano.config.floatX = 'float32'
+    sys.setrecursionlimit(10000)
+
+
+def find_streams(config):
+    """
+    find the [streamN] sections of a config file
+    :param config: parsed config file
+    :return: stream section names ordered by stream number
+    """
+    streams = [s for s in config.sections() if re.match(r'^stream\d+$', s)]
+    return sorted(streams, key=lambda s: int(s[len('stream'):]))
+
+
+def load_stream(config, stream_name):
+    """
+    load the data of a stream
+    :param config: parsed config file
+    :param stream_name: name of the stream section
+    :return: dictionary holding the stream data and settings
+    """
+    stream = dict()
+    stream['name'] = stream_name
+    stream['imagesize'] = tuple([int(d) for d in config.get(stream_name, 'imagesize').split(',')])
+    stream['inputdim'] = config.getint(stream_name, 'input_dimensions')
+    if config.has_option(stream_name, 'features'):
+        stream['data_dir'] = extract_features(config.get(stream_name, 'data'), config.get(stream_name, 'features'),
+                                              stream['imagesize'])
+    else:
+        stream['data_dir'] = convert_mat_dataset(config.get(stream_name, 'data'))
+    stream['data'] = load_dataset(stream['data_dir'])
+    featuredim = stream['data']['dataMatrix'].shape[1]
+    if featuredim != stream['inputdim']:
+        raise ValueError('{} data has {} dimensions, input_dimensions is {}'.format(
+            stream_name, featuredim, stream['inputdim']))
+    return stream
+
+
+def load_stream_models(config, stream, options):
+    """
+    load the pre-trained encoder and lstm weights of a stream
+    :param config: parsed config file
+    :param stream: stream dictionary from load_stream, the weights are stored under 'ae' and 'lstm'
+    :param options: CLI options, 'current_runtime' selects the models of a run
+    """
+    stream_name = stream['name']
+    if 'current_runtime' in options:
+        encoder_path = config.get(stream_name, 'model') + '.' + options['current_runtime'] + '.mat'
+        print('Encoder model path for {}: {}'.format(stream_name, encoder_path))
+    else:
+        encoder_path = config.get(stream_name, 'model')
+    stream['ae'] = load_decoder(encoder_path, config.get(stream_name, 'shape'),
+                                config.get(stream_name, 'nonlinearities'))
+
+    stream['lstm'] = None
+    if config.has_option(stream_name, 'lstm_model'):
+        lstm_path = config.get(stream_name, 'lstm_model')
+        if 'current_runtime' in options:
+            lstm_path = lstm_path + '.' + options['current_runtime'] + '.mat'
+            print('Lstm model path for {}: {}'.format(stream_name, lstm_path))
+        stream['lstm'] = sio.loadmat(lstm_path)
+
+
+def create_network(streams, input_vars, mask, window, lstm_size, lstm2_size, output_classes, fusiontype,
+                   weight_init_fn, use_peepholes, use_blstm_substream, use_dropout, stack_encoders, pack_frames,
+                   fuse_blstm, fuse_stream_lstms, unroll=0):
+    """
+    create the end to end model for the given number of streams
+    :param streams: list of stream dictionaries from load_stream
+    :param input_vars: list of input theano variables, one per stream
+    :param mask: mask theano variable
+    :param window: window theano variable
+    :param lstm_size: number of lstm units for the stream lstm layers
+    :param lstm2_size: number of lstm units for the fusion lstm layer, None uses the stream lstm size
+    :param output_classes: number of output classes
+    :param fusiontype: 'concat', 'sum' or 'adasum'
+    :param weight_init_fn: weight initialization function
+    :param use_peepholes: use peepholes for lstm layers
+    :param use_blstm_substream: use blstm for the pre-trained stream lstm layers
+    :param use_dropout: use dropout before the stream and fusion lstm layers
+    :param stack_encoders: evaluate the stream encoders as one stacked encoder if they share layer shapes
+    :param pack_frames: encode only the valid frames of a batch instead of all padded frames
+    :param fuse_blstm: run both directions of every blstm in one scan
+    :param fuse_stream_lstms: run the lstms of all streams in one scan
+    :param unroll: fixed sequence length to unroll the lstm recurrences to, 0 uses scan
+    :return: output layer of the model
+    """
+    # unrolled models have a fixed sequence length, every batch is padded to it
+    seqlen = unroll or None
+    shapes = [(None, seqlen, s['inputdim']) for s in streams]
+    mask_shape = (None, seqlen)
+    unroll_scan = bool(unroll)
+
+    if len(streams) == 1:
+        return deltanet_majority_vote.create_model(streams[0]['ae'], shapes[0], input_vars[0], mask_shape, mask,
+                                                   lstm_size, window, output_classes,
+                                                   weight_init_fn, use_peepholes, pack_frames=pack_frames,
+                                                   fuse_blstm=fuse_blstm, unroll_scan=unroll_scan)
+
+    # use_dropout builds the dropout model even when pre-trained lstm weights are given
+    if all(s['lstm'] for s in streams) and not use_dropout:
+        print('Initialising lstm model with pre-trained parameters')
+        network, l_fuse = adenet.create_pretrained_model(
+            [(s['ae'], s['lstm'], shape, var) for s, shape, var in zip(streams, shapes, input_vars)],
+            mask_shape, mask, lstm_size, window, output_classes, fusiontype,
+            w_init_fn=weight_init_fn, use_peepholes=use_peepholes,
+            use_blstm_substream=use_blstm_substream, stack_encoders=stack_encoders, pack_frames=pack_frames,
+            fuse_blstm=fuse_blstm, fuse_stream_lstms=fuse_stream_lstms, unroll_scan=unroll_scan)
+    else:
+        network, l_fuse = adenet.create_model(
+            [(s['ae'], shape, var) for s, shape, var in zip(streams, shapes, input_vars)],
+            mask_shape, mask, lstm_size, window, output_classes, fusiontype,
+            w_init_fn=weight_init_fn, use_peepholes=use_peepholes,
+            lstm2_size=lstm2_size, use_dropout=use_dropout, stack_encoders=stack_encoders,
+            pack_frames=pack_frames, fuse_blstm=fuse_blstm, fuse_stream_lstms=fuse_stream_lstms,
+            unroll_scan=unroll_scan)
+    return network
+
+
+def evaluate_model2(streams, batches, window_size, num_classes, eval_fn, cost_fn=None, decision_mode='majority'):
+    """
+    Evaluate a lstm model one mini-batch at a time, only the inputs of the current batch are held in memory
+    :param streams: list of data matrices, one per stream
+    :param batches: list of (gather table, targets, mask, video indexes) batches from gen_eval_batches
+    :param window_size: size of window for computing delta coefficients
+    :param num_classes: number of output classes
+    :param eval_fn: evaluation function
+    :param cost_fn: cost function, None skips computing the cost
+    :param decision_mode: how the frame predictions decide the class of a sequence, see sequence_scores
+    :return: cost, classification rate, confusion matrix, predictions
+    """
+    num_videos = sum(len(idxs) for _, _, _, idxs in batches)
+    ix = np.zeros((num_videos,), dtype='int')
+    y = np.zeros((num_videos,), dtype='int')
+    total_cost = 0.0
+    total_frames = 0
+    for gather_table, y_batch, mask, idxs in batches:
+        X_streams = gather_eval_batch(streams, gather_table, mask)
+        if cost_fn is not None:
+            # the cost is averaged over the frames of a batch
+            y_frames = y_batch.reshape((-1, 1)).repeat(mask.shape[-1], axis=-1)
+            total_cost += cost_fn(*(X_streams + [y_frames, mask, window_size])) * np.sum(mask)
+            total_frames += np.sum(mask)
+        output = eval_fn(*(X_streams + [mask, window_size]))
+        ix[idxs] = np.argmax(sequence_scores(output, mask, decision_mode), axis=-1)
+        y[idxs] = y_batch
+
+    # an empty split has no cost and no correctly classified videos
+    cost = total_cost / max(total_frames, 1) if cost_fn is not None else None
+    classification_rate = float(np.mean(ix == y)) if num_videos else 0.0
+    return cost, classification_rate, confusion_matrix(y, ix, num_classes), ix
+
+
+def presplit_dataprocessing(data_matrix, vidlens, config, stream_name, **kwargs):
+    reorderdata = config.getboolean(stream_name, 'reorderdata')
+    diffimage = config.getboolean(stream_name, 'diffimage')
+    meanremove = config.getboolean(stream_name, 'meanremove')
+    samplewisenormalize = config.getboolean(stream_name, 'samplewisenormalize')
+    if reorderdata:
+        imagesize = kwargs['imagesize']
+        data_matrix = reorder_data(data_matrix, imagesize)
+    if meanremove:
+        data_matrix = sequencewise_mean_image_subtraction(data_matrix, vidlens)
+    if diffimage:
+        data_matrix = compute_diff_images(data_matrix, vidlens)
+    if samplewisenormalize:
+        data_matrix = normalize_input(data_matrix)
+    return data_matrix
+
+
+def postsplit_datapreprocessing(train_X, val_X, test_X, config, stream_name, chunksize=None):
+    """
+    normalize the split data matrices in place
+    :param chunksize: number of frames processed at once, None processes all frames at once
+    """
+    featurewisenormalize = config.getboolean(stream_name, 'featurewisenormalize')
+    if featurewisenormalize:
+        mean, std = featurewise_mean_std(train_X, chunksize)
+        for X in [train_X, val_X, test_X]:
+            apply_featurewise_normalization(X, mean, std, chunksize)
+    return train_X, val_X, test_X
+
+
+# increase when the output of the preprocessing functions changes, so that stale matrices are not reused
+PREPROCESSING_VERSION = 1
+PREPROCESSING_OPTIONS = ['imagesize', 'reorderdata', 'diffimage', 'meanremove', 'samplewisenormalize',
+                         'featurewisenormalize']
+
+
+def preprocess_stream(stream, config, split_index, split_ids, aligned_vidlens=None, cache=None, chunksize=None):
+    """
+    preprocess the data of a stream and split it into the train, validation and test sets.
+    the videos are preprocessed in chunks of whole videos and written into the split data matrices,
+    which are memory-mapped files when a cache is used
+    :param stream: stream dictionary from load_stream
+    :param config: parsed config file
+    :param split_index: split index from create_seq_split_index
+    :param split_ids: (train, val, test) subject ids the split index was computed from
+    :param aligned_vidlens: video lengths to force align the stream to, None to keep the stream as is
+    :param cache: ArtifactCache storing the preprocessed matrices
+    :param chunksize: number of frames preprocessed at once, None preprocesses all frames at once
+    :return: train, validation and test data matrices
+    """
+    data_matrix = stream['data']['dataMatrix']
+    vidlens = stream['data']['videoLengthVec'].reshape((-1,)).astype('int')
+    split_vidlens = vidlens if aligned_vidlens is None else aligned_vidlens
+
+    def compute(allocate):
+        # the split and position within the split of every frame
+        frame_split = np.zeros(np.sum(split_vidlens), dtype='int')
+        frame_pos = np.zeros(np.sum(split_vidlens), dtype='int')
+        split_Xs = []
+        for i, (name, (frame_idxs, _)) in enumerate(zip(['train_X', 'val_X', 'test_X'], split_index)):
+            frame_split[frame_idxs] = i
+            frame_pos[frame_idxs] = np.arange(len(frame_idxs))
+            split_Xs.append(allocate(name, (len(frame_idxs), data_matrix.shape[1]), 'float32'))
+
+        offsets, split_offsets = segment_offsets(vidlens), segment_offsets(split_vidlens)
+        for first, end in segment_chunks(vidlens, chunksize):
+            chunk_vidlens = vidlens[first:end]
+            X = data_matrix[offsets[first]:offsets[end]].astype('float32')
+            X = presplit_dataprocessing(X, chunk_vidlens, config, stream['name'], imagesize=stream['imagesize'])
+            if aligned_vidlens is not None:
+                X = np.take(X, segment_resize_index(chunk_vidlens, aligned_vidlens[first:end]), axis=0)
+            frames = slice(split_offsets[first], split_offsets[end])
+            for i, split_X in enumerate(split_Xs):
+                in_split = frame_split[frames] == i
+                split_X[frame_pos[frames][in_split]] = X[in_split]
+
+        postsplit_datapreprocessing(split_Xs[0], split_Xs[1], split_Xs[2], config, stream['name'], chunksize)
+        return [('train_X', split_Xs[0]), ('val_X', split_Xs[1]), ('test_X', split_Xs[2])]
+
+    cache = cache or ArtifactCache()
+    description = {
+        'version': PREPROCESSING_VERSION,
+        'source': os.path.basename(stream['data_dir']),
+        'options': dict((option, config.get(stream['name'], option)) for option in PREPROCESSING_OPTIONS
+                        if config.has_option(stream['name'], option)),
+        'aligned_vidlens': array_digest(aligned_vidlens) if aligned_vidlens is not None else None,
+        'split': split_ids,
+    }
+    return cache.get(os.path.splitext(os.path.basename(config.get(stream['name'], 'data')))[0],
+                     description, compute)
+
+
+def parse_options():
+    options = dict()
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--config', help='[CONFIG_FILE] config file to use, default=../oulu/config/1stream_test.ini')
+    parser.add_argument('--write_results', help='[FILE] write results to file')
+    parser.add_argument('--learning_rate', help='[LEARNING_RATE] learning rate')
+    parser.add_argument('--save_best', help='[FILE] save the best model')
+    parser.add_argument('--save_plot', help='[FILE_PREFIX] plot the train/validation '
+                                            'loss curve using user supplied prefix')
+    parser.add_argument('--save_predictions', help='[FILE] save the predictions')
+    parser.add_argument('--current_runtime', help='The current running time')
+    parser.add_argument('--function_cache', help='[DIR] reuse compiled theano functions stored in this directory')
+    parser.add_argument('--preprocessing_cache', help='[DIR] reuse preprocessed data matrices stored in this directory')
+    parser.add_argument('--preprocessing_chunksize', type=int,
+                        help='[FRAMES] preprocess the data in chunks of about FRAMES frames of whole videos '
+                             'to bound memory, default=all frames at once')
+    parser.add_argument('--runs', help='[START:END] run the experiment for runs START to END in this process, '
+                                       'output file names are formatted with the run number, e.g. results.{}.txt')
+    parser.add_argument('--run_models', action='store_true',
+                        help='load the encoder and lstm models of every run (model.RUN.mat), '
+                             'like --current_runtime does for a single run')
+
+    args = parser.parse_args()
+    options['config'] = args.config if args.config else '../oulu/config/1stream_test.ini'
+    if args.write_results:
+        options['write_results'] = args.write_results
+    if args.learning_rate:
+        options['learning_rate'] = float(args.learning_rate)
+    if args.save_best:
+        options['save_best'] = args.save_best
+    if args.save_plot:
+        options['save_plot'] = args.save_plot
+    if args.save_predictions:
+        options['save_predictions'] = args.save_predictions
+    if args.current_runtime:
+        options['current_runtime'] = args.current_runtime
+    if args.function_cache:
+        options['function_cache'] = args.function_cache
+    if args.preprocessing_cache:
+        options['preprocessing_cache'] = args.preprocessing_cache
+    if args.preprocessing_chunksize:
+        options['preprocessing_chunksize'] = args.preprocessing_chunksize
+    if args.runs:
+        start, end = [int(r) for r in args.runs.split(':')]
+        options['runs'] = list(range(start, end + 1))
+        options['run_models'] = args.run_models
+    return options
+
+
+def run_options(options, run):
+    """
+    options of a single run of a multi-run invocation
+    :param options: CLI options
+    :param run: run number
+    :return: options with the output file names formatted with the run number
+    """
+    options = dict(options)
+    for key in ['write_results', 'save_best', 'save_plot', 'save_predictions']:
+        if key in options:
+            options[key] = options[key].format(run)
+    if options.get('run_models'):
+        options['current_runtime'] = str(run)
+    return options
+
+
+def main():
+    configure_theano()
+    options = parse_options()
+    config_file = options['config']
+    config = ConfigParser.ConfigParser()
+    config.read(config_file)
+
+    print('CLI options: {}'.format(options.items()))
+
+    print('Reading Config File: {}...'.format(config_file))
+    stream_names = find_streams(config)
+    for stream_name in stream_names:
+        print(config.items(stream_name))
+    print(config.items('lstm_classifier'))
+    print(config.items('training'))
+
+    print('preprocessing dataset...')
+    streams = [load_stream(config, stream_name) for stream_name in stream_names]
+
+    # lstm classifier
+    fusiontype = config.get('lstm_classifier', 'fusiontype') \
+        if config.has_option('lstm_classifier', 'fusiontype') else 'concat'
+    weight_init = options['weight_init'] if 'weight_init' in options else config.get('lstm_classifier', 'weight_init')
+    use_peepholes = options['use_peepholes'] if 'use_peepholes' in options else config.getboolean('lstm_classifier',
+                                                                                                  'use_peepholes')
+    windowsize = config.getint('lstm_classifier', 'windowsize')
+    output_classes = config.getint('lstm_classifier', 'output_classes')
+    output_classnames = config.get('lstm_classifier', 'output_classnames').split(',')
+    lstm_size = config.getint('lstm_classifier', 'lstm_size')
+    lstm2_size = config.getint('lstm_classifier', 'lstm2_size') \
+        if config.has_option('lstm_classifier', 'lstm2_size') else None
+    matlab_target_offset = config.getboolean('lstm_classifier', 'matlab_target_offset')
+    use_dropout = config.getboolean('lstm_classifier', 'use_dropout') \
+        if config.has_option('lstm_classifier', 'use_dropout') else False
+    use_blstm_substream = config.getboolean('lstm_classifier', 'use_blstm_substream') \
+        if config.has_option('lstm_classifier', 'use_blstm_substream') else False
+    stack_encoders = config.getboolean('lstm_classifier', 'stack_encoders') \
+        if config.has_option('lstm_classifier', 'stack_encoders') else False
+    pack_frames = config.getboolean('lstm_classifier', 'pack_frames') \
+        if config.has_option('lstm_classifier', 'pack_frames') else False
+    fuse_blstm = config.getboolean('lstm_classifier', 'fuse_blstm') \
+        if config.has_option('lstm_classifier', 'fuse_blstm') else False
+    fuse_stream_lstms = config.getboolean('lstm_classifier', 'fuse_stream_lstms') \
+        if config.has_option('lstm_classifier', 'fuse_stream_lstms') else False
+    unroll = config.getint('lstm_classifier', 'unroll') \
+        if config.has_option('lstm_classifier', 'unroll') else 0
+    decision_mode = config.get('lstm_classifier', 'decision_mode') \
+        if config.has_option('lstm_classifier', 'decision_mode') else 'majority'
+
+    # capture training parameters
+    validation_window = int(options['validation_window']) \
+        if 'validation_window' in options else config.getint('training', 'validation_window')
+    num_epoch = int(options['num_epoch']) if 'num_epoch' in options else config.getint('training', 'num_epoch')
+    learning_rate = options['learning_rate'] if 'learning_rate' in options \
+        else config.getfloat('training', 'learning_rate')
+    epochsize = config.getint('training', 'epochsize')
+    batchsize = config.getint('training', 'batchsize')
+    bucket_batches = config.getboolean('training', 'bucket_batches') \
+        if config.has_option('training', 'bucket_batches') else False
+    eval_batchsize = config.getint('training', 'eval_batchsize') \
+        if config.has_option('training', 'eval_batchsize') else 32
+
+    weight_init_fn = las.init.GlorotUniform()
+    if weight_init == 'glorot':
+        weight_init_fn = las.init.GlorotUniform()
+    if weight_init == 'norm':
+        weight_init_fn = las.init.Normal(0.1)
+    if weight_init == 'uniform':
+        weight_init_fn = las.init.Uniform()
+    if weight_init == 'ortho':
+        weight_init_fn = las.init.Orthogonal()
+
+    train_subject_ids = read_data_split_file(config.get('training', 'train_subjects_file'))
+    val_subject_ids = read_data_split_file(config.get('training', 'val_subjects_file'))
+    test_subject_ids = read_data_split_file(config.get('training', 'test_subjects_file'))
+
+    targets_vec = streams[0]['data']['targetsVec'].reshape((-1,))
+    subjects_vec = streams[0]['data']['subjectsVec'].reshape((-1,))
+    vidlen_vec = streams[0]['data']['videoLengthVec'].reshape((-1,))
+
+    if matlab_target_offset:
+        targets_vec = targets_vec - 1
+
+    force_align_data = config.getboolean('stream1', 'force_align_data') \
+        if config.has_option('stream1', 'force_align_data') else False
+    aligned_vidlen_vec = None
+    if force_align_data and len(streams) > 1:
+        # pad the videos of every stream to the longest stream, see multistream_force_align
+        aligned_vidlen_vec = np.max([s['data']['videoLengthVec'].reshape((-1,)) for s in streams], axis=0)
+        targets_vec = np.take(targets_vec, segment_resize_index(vidlen_vec, aligned_vidlen_vec))
+    split_vidlen_vec = vidlen_vec if aligned_vidlen_vec is None else aligned_vidlen_vec
+
+    # the split only depends on the subjects and video lengths, compute it once for all streams
+    split_index = create_seq_split_index(subjects_vec, split_vidlen_vec,
+                                         train_subject_ids, val_subject_ids, test_subject_ids)
+    train_y, train_vidlens, train_subjects, \
+    val_y, val_vidlens, val_subjects, \
+    test_y, test_vidlens, test_subjects = split_seq_labels(targets_vec, subjects_vec, split_vidlen_vec, split_index)
+    if unroll:
+        # fail before compiling if a video does not fit the unrolled model
+        check_pad_to(split_vidlen_vec, unroll)
+
+    preprocessing_cache = ArtifactCache(options.get('preprocessing_cache'))
+    split_ids = (train_subject_ids, val_subject_ids, test_subject_ids)
+    train_Xs, val_Xs, test_Xs = [], [], []
+    for s in streams:
+        s_train_X, s_val_X, s_test_X = preprocess_stream(s, config, split_index, split_ids, aligned_vidlen_vec,
+                                                         preprocessing_cache, options.get('preprocessing_chunksize'))
+        train_Xs.append(s_train_X)
+        val_Xs.append(s_val_X)
+        test_Xs.append(s_test_X)
+    if preprocessing_cache.cache_dir:
+        print('preprocessing cache: {}'.format(preprocessing_cache.summary()))
+
+    window = T.iscalar('theta')
+    inputs = [T.tensor3('inputs{}'.format(i + 1), dtype='float32') for i in range(len(streams))]
+    mask = T.matrix('mask', dtype='uint8')
+    targets = T.imatrix('targets')
+
+    runs = options.get('runs', [None])
+    first_options = options
+    if runs[0] is not None:
+        first_options = run_options(options, runs[0])
+        np.random.seed(runs[0])
+        las.random.set_rng(np.random.RandomState(runs[0]))
+    for s in streams:
+        load_stream_models(config, s, first_options)
+
+    print('constructing end to end model...')
+    network = create_network(streams, inputs, mask, window, lstm_size, lstm2_size, output_classes, fusiontype,
+                             weight_init_fn, use_peepholes, use_blstm_substream, use_dropout, stack_encoders,
+                             pack_frames, fuse_blstm, fuse_stream_lstms, unroll)
+
+    print_network(network)
+    print('compiling model...')
+    predictions = las.layers.get_output(network, deterministic=False)
+    all_params = las.layers.get_all_params(network, trainable=True)
+    cost = temporal_softmax_loss(predictions, targets, mask)
+    updates = adam(cost, all_params, learning_rate=learning_rate)
+
+    test_predictions = las.layers.get_output(network, deterministic=True)
+    test_cost = temporal_softmax_loss(test_predictions, targets, mask)
+
+    # compiled functions are reused between runs of the same model if a cache directory is given
+    function_cache = FunctionCache(network, options.get('function_cache'), extra={'learning_rate': learning_rate})
+    train, compute_train_cost, compute_test_cost, val_fn = function_cache.compile([
+        ('train', lambda: theano.function(inputs + [targets, mask, window],
+                                          cost, updates=updates, allow_input_downcast=True)),
+        ('compute_train_cost', lambda: theano.function(inputs + [targets, mask, window],
+                                                       cost, allow_input_downcast=True)),
+        ('compute_test_cost', lambda: theano.function(inputs + [targets, mask, window],
+                                                      test_cost, allow_input_downcast=True)),
+        ('val_fn', lambda: theano.function(inputs + [mask, window], test_predictions, allow_input_downcast=True)),
+    ])
+    print(function_cache.summary())
+    optimizer_state = get_optimizer_state(train, network)
+
+    if bucket_batches and not unroll:
+        print(padding_summary(train_vidlens, batchsize))
+
+    # the validation and test sets are evaluated in length sorted mini-batches
+    val_batches = gen_eval_batches(val_y, val_vidlens, eval_batchsize, pad_to=unroll or None)
+    test_batches = gen_eval_batches(test_y, test_vidlens, eval_batchsize, pad_to=unroll or None)
+
+    fns = (train, compute_train_cost, compute_test_cost, val_fn)
+    settings = dict(num_epoch=num_epoch, epochsize=epochsize, validation_window=validation_window,
+                    windowsize=windowsize, learning_rate=learning_rate, decision_mode=decision_mode)
+    for run_no, run in enumerate(runs):
+        current_options = run_options(options, run) if run is not None else options
+        if run_no > 0:
+            print('starting run {}...'.format(run))
+            # re-initialise the compiled network with this run's models and a run specific seed
+            np.random.seed(run)
+            las.random.set_rng(np.random.RandomState(run))
+            for s in streams:
+                load_stream_models(config, s, current_options)
+            fresh_inputs = [T.tensor3('inputs{}'.format(i + 1), dtype='float32') for i in range(len(streams))]
+            fresh_network = create_network(streams, fresh_inputs, mask, window, lstm_size, lstm2_size,
+                                           output_classes, fusiontype, weight_init_fn, use_peepholes,
+                                           use_blstm_substream, use_dropout, stack_encoders, pack_frames,
+                                           fuse_blstm, fuse_stream_lstms, unroll)
+            las.layers.set_all_param_values(network, las.layers.get_all_param_values(fresh_network))
+            set_optimizer_state(optimizer_state)
+
+        # prepare the training batches of all streams on a background thread
+        datagen = MultiStreamBatchLoader(train_Xs, train_y, train_vidlens, batchsize=batchsize,
+                                         bucket=bucket_batches, pad_to=unroll or None)
+        results = train_model(network, fns, datagen, val_Xs, val_batches, test_Xs, test_batches, settings)
+        print(datagen.summary())
+        datagen.close()
+        save_results(network, results, output_classnames, current_options)
+
+
+def get_optimizer_state(train_fn, network):
+    """
+    snapshot the optimizer state of a training function, the shared variables that are not network parameters
+    :param train_fn: compiled training function
+    :param network: output layer of the network
+    :return: list of (shared variable, initial value)
+    """
+    param_storage = set(id(p.container) for p in las.layers.get_all_params(network))
+    # random number generator states are not floats and keep running across runs
+    return [(s, s.get_value()) for s in train_fn.get_shared()
+            if id(s.container) not in param_storage and s.dtype.startswith('float')]
+
+
+def set_optimizer_state(state):
+    for shared_var, value in state:
+        shared_var.set_value(value)
+
+
+def train_model(network, fns, datagen, val_Xs, val_batches, test_Xs, test_batches, settings):
+    """
+    train a network until the validation loss stops improving
+    :param network: output layer of the network
+    :param fns: compiled (train, compute_train_cost, compute_test_cost, val_fn) functions
+    :param datagen: training batch generator
+    :param val_Xs: validation data matrices, one per stream
+    :param val_batches: validation batches from gen_eval_batches
+    :param test_Xs: test data matrices, one per stream
+    :param test_batches: test batches from gen_eval_batches
+    :param settings: dictionary of num_epoch, epochsize, validation_window, windowsize, learning_rate
+                     and decision_mode
+    :return: dictionary of results of the best model
+    """
+    train, compute_train_cost, compute_test_cost, val_fn = fns
+    num_epoch = settings['num_epoch']
+    epochsize = settings['epochsize']
+    validation_window = settings['validation_window']
+    windowsize = settings['windowsize']
+    learning_rate = settings['learning_rate']
+    decision_mode = settings['decision_mode']
+    output_classes = network.output_shape[-1]
+
+    # We'll train the network with 10 epochs of 30 minibatches each
+    print('begin training...')
+    cost_train = []
+    cost_val = []
+    class_rate = []
+    STRIP_SIZE = 3
+    val_window = circular_list(validation_window)
+    train_strip = np.zeros((STRIP_SIZE,))
+    best_val = float('inf')
+    best_cr = 0.0
+
+    for epoch in range(num_epoch):
+        time_start = time.time()
+        for i in range(epochsize):
+            Xs, y, m, batch_idxs = next(datagen)
+            # repeat targets based on max sequence len
+            y = y.reshape((-1, 1))
+            y = y.repeat(m.shape[-1], axis=-1)
+            print_str = 'Epoch {} batch {}/{}: {} examples using adam with learning rate = {}'.format(
+                epoch + 1, i + 1, epochsize, len(Xs[0]), learning_rate)
+            print(print_str, end='')
+            sys.stdout.flush()
+            train(*(Xs + [y, m, windowsize]))
+            print('\r', end='')
+        cost = compute_train_cost(*(Xs + [y, m, windowsize]))
+        val_cost, cr, val_conf, _ = evaluate_model2(val_Xs, val_batches, windowsize, output_classes, val_fn,
+                                                    compute_test_cost, decision_mode)
+        cost_train.append(cost)
+        cost_val.append(val_cost)
+        class_rate.append(cr)
+        train_strip[epoch % STRIP_SIZE] = cost
+        val_window.push(val_cost)
+
+        gl = 100 * (cost_val[-1] / np.min(cost_val) - 1)
+        pk = 1000 * (np.sum(train_strip) / (STRIP_SIZE * np.min(train_strip)) - 1)
+        pq = gl / pk
+
+        if val_cost < best_val:
+            best_val = val_cost
+            best_cr = cr
+            _, test_cr, test_conf, test_ix = evaluate_model2(test_Xs, test_batches, windowsize, output_classes, val_fn,
+                                                             decision_mode=decision_mode)
+            print("Epoch {} train cost = {}, val cost = {}, "
+                  "GL loss = {:.3f}, GQ = {:.3f}, CR = {:.3f}, Test CR= {:.3f} ({:.1f}sec)"
+                  .format(epoch + 1, cost_train[-1], cost_val[-1], gl, pq, cr, test_cr, time.time() - time_start))
+            best_params = las.layers.get_all_param_values(network)
+        else:
+            print("Epoch {} train cost = {}, val cost = {}, "
+                  "GL loss = {:.3f}, GQ = {:.3f}, CR = {:.3f} ({:.1f}sec)"
+                  .format(epoch + 1, cost_train[-1], cost_val[-1], gl, pq, cr, time.time() - time_start))
+
+        if epoch >= validation_window and early_stop2(val_window, best_val, validation_window):
+            break
+
+    return dict(test_cr=test_cr, test_conf=test_conf, test_ix=test_ix, best_cr=best_cr, best_val=best_val,
+                best_params=best_params, cost_train=cost_train, cost_val=cost_val)
+
+
+def save_results(network, results, output_classnames, options):
+    """
+    print the results of a run and write them to the output files given in the options
+    :param network: output layer of the network
+    :param results: dictionary returned by train_model
+    :param output_classnames: names of the output classes
+    :param options: CLI options of the run
+    """
+    test_cr, best_cr, best_val = results['test_cr'], results['best_cr'], results['best_val']
+    print('Final Model')
+    print('CR: {}, val loss: {}, Test CR: {}'.format(best_cr, best_val, test_cr))
+
+    # plot confusion matrix
+    table_str = plot_confusion_matrix(results['test_conf'], output_classnames, fmt='pipe')
+    print('confusion matrix: ')
+    print(table_str)
+
+    if 'save_plot' in options:
+        prefix = options['save_plot']
+        plot_validation_cost(results['cost_train'], results['cost_val'],
+                             savefilename='{}.validloss.png'.format(prefix))
+        with open('{}.confmat.txt'.format(prefix), mode='a') as f:
+            f.write(table_str)
+            f.write('\n\n')
+
+    if 'write_results' in options:
+        print('writing results to {}'.format(options['write_results']))
+        results_file = options['write_results']
+        with open(results_file, mode='a') as f:
+            f.write('{},{},{}\n'.format(test_cr, best_cr, best_val))
+
+    if 'save_predictions' in options:
+        print('writing predictions to {}'.format(options['save_predictions']))
+        results_file = options['save_predictions']
+        with open(results_file, mode='a') as f:
+            f.write('{}\n'.format(results['test_ix']))
+
+    if 'save_best' in options:
+        print('saving best model...')
+        las.layers.set_all_param_values(network, results['best_params'])
+        save_model_params(network, options['save_best'])
+        print('best model saved to {}'.format(options['save_best']))
+
+
+if __name__ == '__main__':
+    main()
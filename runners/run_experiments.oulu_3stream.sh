@@ -5,6 +5,8 @@ RESULTS_DIR=../oulu/results/3stream
 PREDICTIONS_DIR=$RESULTS_DIR/predictions
 BEST_MODEL_DIR=$RESULTS_DIR/best_models
 PLOTS_DIR=$RESULTS_DIR/plots
+FUNCTION_CACHE=../oulu/cache/theano_functions
+PREPROCESSING_CACHE=../oulu/cache/preprocessed
 
 # create necessary directories
 mkdir -p $CONFIG_DIR
@@ -27,6 +29,6 @@ if [ $FIRST_CHAR != "#" ]; then
 RUNNER=`echo $line | cut -d ',' -f 1`
 EXPERIMENT_NAME=`echo $line | cut -d ',' -f 2`
 echo "runner=$RUNNER experiment=$EXPERIMENT_NAME"
-for i in $(eval echo "{$START..$END}"); do python $RUNNER --config $CONFIG_DIR/$EXPERIMENT_NAME.ini --current_runtime $i --write_results $RESULTS_DIR/$EXPERIMENT_NAME.$i.txt --save_predictions $PREDICTIONS_DIR/$EXPERIMENT_NAME.$i.txt --save_best $BEST_MODEL_DIR/$EXPERIMENT_NAME.$i.pkl --save_plot $PLOTS_DIR/$EXPERIMENT_NAME.$i; done
+python $RUNNER --config $CONFIG_DIR/$EXPERIMENT_NAME.ini --write_results $RESULTS_DIR/$EXPERIMENT_NAME.{}.txt --save_predictions $PREDICTIONS_DIR/$EXPERIMENT_NAME.{}.txt --save_best $BEST_MODEL_DIR/$EXPERIMENT_NAME.{}.pkl --save_plot $PLOTS_DIR/$EXPERIMENT_NAME.{} --function_cache $FUNCTION_CACHE --preprocessing_cache $PREPROCESSING_CACHE --runs $START:$END --run_models
 fi;
 done
@@ -0,0 +1,244 @@
+"""
+Runs the experiments listed in experiment files on a pool of worker processes.
+
+usage: python sweep.py ./experiments/oulu_1stream_experiments.txt ./experiments/oulu_2stream_experiments.txt ...
+
+Every (config, run) pair is a separate job. The single-view experiments run first. The encoder and lstm
+weights are then extracted from their best models, and the multi-view experiments run last, because they
+are initialised with those weights. A job is skipped if its best model file already exists, so an
+interrupted sweep can be restarted with the same command.
+"""
+from __future__ import print_function
+import os
+import re
+import sys
+import time
+import argparse
+import subprocess
+import ConfigParser
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
+
+CONFIG_DIR = '../oulu/config'
+RESULTS_ROOT = '../oulu/results'
+FUNCTION_CACHE = '../oulu/cache/theano_functions'
+PREPROCESSING_CACHE = '../oulu/cache/preprocessed'
+EXTRACT_WEIGHTS_DIR = '../oulu/extract_weights'
+EXTRACT_WEIGHTS_SCRIPTS = ['extract_encoder_from_1stream_final.py', 'extract_lstm_from_1stream_final.py']
+BLAS_THREAD_VARS = ['OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS']
+
+
+def read_experiment_file(path):
+    """
+    read the (runner, experiment name) lines of an experiment file, lines starting with # are skipped
+    :param path: experiment file
+    :return: list of (runner, experiment name)
+    """
+    experiments = []
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            runner, name = line.split(',')[:2]
+            experiments.append((runner.strip(), name.strip()))
+    return experiments
+
+
+def read_config(name):
+    config = ConfigParser.ConfigParser()
+    config.read(os.path.join(CONFIG_DIR, name + '.ini'))
+    return config
+
+
+def count_streams(config):
+    return len([s for s in config.sections() if re.match(r'^stream\d+$', s)])
+
+
+def required_models(config, run):
+    """
+    :return: the pre-trained model files a multi-view experiment loads for a run
+    """
+    paths = []
+    for section in config.sections():
+        if not re.match(r'^stream\d+$', section):
+            continue
+        for option in ['model', 'lstm_model']:
+            if config.has_option(section, option):
+                paths.append('{}.{}.mat'.format(config.get(section, option), run))
+    return paths
+
+
+class Job(object):
+    """
+    A single run of an experiment
+    """
+    def __init__(self, runner, name, run, no_streams):
+        self.runner = runner
+        self.name = name
+        self.run = run
+        self.no_streams = no_streams
+        self.results_dir = os.path.join(RESULTS_ROOT, '{}stream'.format(no_streams))
+
+    def output(self, subdir, suffix):
+        path = os.path.join(self.results_dir, subdir) if subdir else self.results_dir
+        return os.path.join(path, '{}.{}{}'.format(self.name, self.run, suffix))
+
+    def outputs(self):
+        return [self.output('', '.txt'), self.output('predictions', '.txt'),
+                self.output('plots', '.confmat.txt'), self.output('best_models', '.pkl')]
+
+    def done(self):
+        # the best model is written last, once it exists all other outputs are complete
+        return os.path.exists(self.output('best_models', '.pkl'))
+
+    def command(self):
+        command = [sys.executable, self.runner,
+                   '--config', os.path.join(CONFIG_DIR, self.name + '.ini'),
+                   '--write_results', self.output('', '.txt'),
+                   '--save_predictions', self.output('predictions', '.txt'),
+                   '--save_best', self.output('best_models', '.pkl'),
+                   '--save_plot', self.output('plots', ''),
+                   '--function_cache', FUNCTION_CACHE,
+                   '--preprocessing_cache', PREPROCESSING_CACHE,
+                   '--runs', '{}:{}'.format(self.run, self.run)]
+        if self.no_streams > 1:
+            command.append('--run_models')
+        return command
+
+    def __str__(self):
+        return '{}.{}'.format(self.name, self.run)
+
+
+def blas_env(threads):
+    env = dict(os.environ)
+    for var in BLAS_THREAD_VARS:
+        env[var] = str(threads)
+    return env
+
+
+def create_results_dirs(jobs):
+    """
+    create the output directories of the jobs, before the workers start so they do not race to create them
+    """
+    for results_dir in sorted(set(job.results_dir for job in jobs)):
+        for subdir in ['predictions', 'plots', 'best_models', 'logs']:
+            path = os.path.join(results_dir, subdir)
+            if not os.path.isdir(path):
+                os.makedirs(path)
+
+
+def run_job(job, env):
+    """
+    run a job in a subprocess, the output is written to a log file next to the results
+    :return: (job, return code, seconds)
+    """
+    # results and confusion matrices are appended to, remove what an interrupted run left behind
+    for path in job.outputs():
+        if os.path.exists(path):
+            os.remove(path)
+    start = time.time()
+    with open(job.output('logs', '.log'), 'w') as log:
+        returncode = subprocess.call(job.command(), stdout=log, stderr=subprocess.STDOUT, env=env)
+    return job, returncode, time.time() - start
+
+
+def run_pool(jobs, workers, env):
+    """
+    run jobs on a pool of workers
+    :return: list of failed jobs
+    """
+    failed = []
+    if not jobs:
+        return failed
+    pool = ThreadPool(workers)
+    try:
+        for i, (job, returncode, seconds) in enumerate(pool.imap_unordered(lambda j: run_job(j, env), jobs), 1):
+            status = 'done' if returncode == 0 else 'FAILED ({})'.format(returncode)
+            print('[{}/{}] {} {} in {:.0f}sec'.format(i, len(jobs), job, status, seconds))
+            sys.stdout.flush()
+            if returncode != 0:
+                failed.append(job)
+    finally:
+        pool.close()
+        pool.join()
+    return failed
+
+
+def extract_weights(paths, env):
+    """
+    extract the encoder and lstm weights of the single-view best models
+    :param paths: model files to extract, only these (view, run) models are extracted
+    :return: True if all extraction scripts succeeded
+    """
+    # the scripts take <output name>.<run>, the file names without the .mat extension
+    outputs = sorted(set(os.path.splitext(os.path.basename(path))[0] for path in paths))
+    success = True
+    for script in EXTRACT_WEIGHTS_SCRIPTS:
+        print('running {}...'.format(script))
+        sys.stdout.flush()
+        if subprocess.call([sys.executable, script] + outputs, cwd=EXTRACT_WEIGHTS_DIR, env=env) != 0:
+            success = False
+    return success
+
+
+def parse_options():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('experiment_files', nargs='+', help='experiment files listing runner,experiment lines')
+    parser.add_argument('--runs', default='1:10', help='[START:END] runs of every experiment, default=1:10')
+    parser.add_argument('--blas_threads', type=int, default=1, help='BLAS/OpenMP threads per worker, default=1')
+    parser.add_argument('--workers', type=int,
+                        help='number of parallel jobs, default=number of cores / blas_threads')
+    parser.add_argument('--dry_run', action='store_true', help='list the jobs without running them')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_options()
+    start, end = [int(r) for r in args.runs.split(':')]
+    workers = args.workers if args.workers else max(1, cpu_count() // args.blas_threads)
+    env = blas_env(args.blas_threads)
+
+    single_view_jobs, multi_view_jobs, configs = [], [], {}
+    for experiment_file in args.experiment_files:
+        for runner, name in read_experiment_file(experiment_file):
+            configs[name] = read_config(name)
+            no_streams = count_streams(configs[name])
+            for run in range(start, end + 1):
+                job = Job(runner, name, run, no_streams)
+                (single_view_jobs if no_streams == 1 else multi_view_jobs).append(job)
+
+    pending = [job for job in single_view_jobs + multi_view_jobs if not job.done()]
+    print('{} jobs, {} already done, {} workers with {} BLAS threads each'.format(
+        len(single_view_jobs) + len(multi_view_jobs), len(single_view_jobs) + len(multi_view_jobs) - len(pending),
+        workers, args.blas_threads))
+    if args.dry_run:
+        for job in pending:
+            print(' '.join(job.command()))
+        return
+
+    create_results_dirs(pending)
+    failed = run_pool([job for job in single_view_jobs if not job.done()], workers, env)
+
+    multi_view_pending = [job for job in multi_view_jobs if not job.done()]
+    missing = [path for job in multi_view_pending for path in required_models(configs[job.name], job.run)
+               if not os.path.exists(path)]
+    if missing and not extract_weights(missing, env):
+        print('some single-view models could not be extracted')
+    # only the jobs whose own single-view models are missing cannot run
+    blocked = [job for job in multi_view_pending
+               if not all(os.path.exists(path) for path in required_models(configs[job.name], job.run))]
+    if blocked:
+        print('cannot run {} multi-view jobs, their single-view models are missing'.format(len(blocked)))
+        multi_view_pending = [job for job in multi_view_pending if job not in blocked]
+        failed += blocked
+
+    failed += run_pool(multi_view_pending, workers, env)
+
+    if failed:
+        print('{} jobs failed: {}'.format(len(failed), ', '.join(str(job) for job in failed)))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
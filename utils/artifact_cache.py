@@ -0,0 +1,106 @@
+"""
+Content-addressed cache of preprocessed data matrices.
+
+An artifact is a set of named arrays stored as .npy files in a directory named after the hash of a
+json description of everything the arrays were computed from. Cached arrays are memory-mapped
+read-only, so processes running experiments on the same view share the page cache.
+"""
+from __future__ import print_function
+import os
+import json
+import shutil
+import hashlib
+import numpy as np
+
+
+def artifact_key(description):
+    """
+    :param description: json serializable description of the inputs of an artifact
+    :return: hex digest
+    """
+    return hashlib.sha1(json.dumps(description, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+def array_digest(array):
+    """
+    :param array: numpy array
+    :return: hex digest of the array dtype, shape and contents
+    """
+    array = np.ascontiguousarray(array)
+    sha1 = hashlib.sha1('{}{}'.format(array.dtype.str, array.shape).encode('utf-8'))
+    sha1.update(array.view(np.uint8).reshape((-1,)) if array.size else b'')
+    return sha1.hexdigest()
+
+
+def _allocate_in_memory(name, shape, dtype):
+    return np.empty(shape, dtype=dtype)
+
+
+class ArtifactCache(object):
+    """
+    Stores groups of arrays under the hash of their description
+    """
+    def __init__(self, cache_dir=None):
+        """
+        Constructs an artifact cache
+        :param cache_dir: directory to store the artifacts, None disables caching
+        """
+        self.cache_dir = cache_dir
+        self.hits = 0
+        self.misses = 0
+
+    def path(self, name, description):
+        return os.path.join(self.cache_dir, '{}.{}'.format(name, artifact_key(description)))
+
+    def get(self, name, description, compute_fn):
+        """
+        load an artifact from the cache, or compute and store it
+        :param name: readable name of the artifact, prefixes the directory name
+        :param description: json serializable description of everything compute_fn depends on
+        :param compute_fn: function taking an allocate(array name, shape, dtype) function and returning a list of
+                           (array name, array) pairs. allocated arrays are written to the cache directly, as
+                           memory-mapped .npy files, so they never have to be held in memory at once
+        :return: list of arrays in the order returned by compute_fn, memory-mapped if cached
+        """
+        if not self.cache_dir:
+            return [array for _, array in compute_fn(_allocate_in_memory)]
+        path = self.path(name, description)
+        if not os.path.isdir(path):
+            self.misses += 1
+            self._compute(path, description, compute_fn)
+        else:
+            self.hits += 1
+        with open(os.path.join(path, 'artifact.json')) as f:
+            names = json.load(f)['arrays']
+        return [np.load(os.path.join(path, '{}.npy'.format(n)), mmap_mode='r') for n in names]
+
+    def _compute(self, path, description, compute_fn):
+        # write to a temporary directory first so concurrent readers never see a partial artifact
+        tmp_path = '{}.tmp{}'.format(path, os.getpid())
+        if os.path.isdir(tmp_path):
+            shutil.rmtree(tmp_path)
+        os.makedirs(tmp_path)
+        allocated = {}
+
+        def allocate(n, shape, dtype):
+            allocated[n] = np.lib.format.open_memmap(os.path.join(tmp_path, '{}.npy'.format(n)), mode='w+',
+                                                     dtype=dtype, shape=shape)
+            return allocated[n]
+
+        arrays = compute_fn(allocate)
+        for n, array in arrays:
+            if n in allocated and array is allocated[n]:
+                array.flush()
+            else:
+                np.save(os.path.join(tmp_path, '{}.npy'.format(n)), array)
+        allocated.clear()
+        with open(os.path.join(tmp_path, 'artifact.json'), 'w') as f:
+            json.dump({'arrays': [n for n, _ in arrays], 'description': description}, f, default=str)
+        try:
+            os.rename(tmp_path, path)
+        except OSError:
+            # another process stored the same artifact first
+            shutil.rmtree(tmp_path)
+
+    def summary(self):
+        return '{} artifacts loaded from cache, {} computed'.format(self.hits, self.misses)
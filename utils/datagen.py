@@ -1,4 +1,10 @@
+import time
+import threading
 import numpy as np
+try:
+    import Queue as queue
+except ImportError:
+    import queue
 
 
 def gen_lstm_seq_random(X, y, seqlen):
@@ -26,66 +32,144 @@ def gen_lstm_seq_random(X, y, seqlen):
             yield seq_X, seq_y
 
 
-def gen_lstm_batch_random(X, y, seqlen, batchsize=30, shuffle=True):
+def gen_batch_idxs(no_videos, batchsize=30, shuffle=True, rng=np.random):
     """
-    randomized data generator for training data
-    creates an infinite loop of mini batches
-    :param X: input
-    :param y: target
-    :param seqlen: lengths of video
+    generate the video indexes of each batch in an infinite loop
+    the last batch of a pass holds the remaining videos, then the videos are permutated again
+    :param no_videos: number of videos
     :param batchsize: number of videos per batch
-    :return: x_train, y_target, input_mask, video idx used
+    :param shuffle: permutate the videos every time all videos are used
+    :param rng: random number generator used for the permutations
+    :return: video idxs of the batch
     """
-    # find the max len of all videos for creating the mask
-    max_timesteps = np.max(seqlen)
-    feature_len = X.shape[1]
-    no_videos = len(seqlen)
     start_video = 0
     reset = False
 
-    # compute integral lengths of the video for fast offset access for data matrix
-    integral_lens = [0]
-    for i in range(1, len(seqlen)):
-        integral_lens.append(integral_lens[i-1] + seqlen[i - 1])
-
     # permutate the video sequences for each batch
     if shuffle:
-        randomized = np.random.permutation(len(seqlen))
+        randomized = rng.permutation(no_videos)
     else:
-        randomized = range(len(seqlen))
+        randomized = np.arange(no_videos)
     while True:
         end_video = start_video + batchsize
         if end_video >= no_videos:  # all videos iterated, reset
             batch_video_idxs = randomized[start_video:]
-            # extract all the video lengths of the video idx
             reset = True
         else:
             batch_video_idxs = randomized[start_video:end_video]
-        bsize = len(batch_video_idxs)
-        X_batch = np.zeros((bsize, max_timesteps, feature_len), dtype=X.dtype)  # returned batch input
-        y_batch = np.zeros((bsize,), dtype='uint8')
-        mask = np.zeros((bsize, max_timesteps), dtype='uint8')
-
-        # populate the batch X and batch y
-        for i, idx in enumerate(batch_video_idxs):
-            start = integral_lens[idx]
-            l = seqlen[idx]
-            end = start + l
-            X_batch[i] = np.concatenate([X[start:end],
-                                         np.zeros((max_timesteps - l, feature_len))])
-            y_batch[i] = y[start]
-            mask[i, :l] = 1  # set 1 for length of video
-            mask[i, l:] = 0  # set 0 for rest of video
         if reset:
             # permutate the new video sequences for each batch
             if shuffle:
-                randomized = np.random.permutation(len(seqlen))
-            else:
-                randomized = range(len(seqlen))
+                randomized = rng.permutation(no_videos)
             start_video = 0
             reset = False
         else:
             start_video = end_video
+        yield batch_video_idxs
+
+
+def gen_bucket_batch_idxs(seqlens, batchsize=30, rng=np.random, pool_batches=50):
+    """
+    generate the video indexes of each batch in an infinite loop, grouping videos of similar length.
+    every pass permutates the videos, sorts pools of pool_batches batches by length, cuts the pools
+    into batches and then permutates the order of the batches.
+    :param seqlens: lengths of video
+    :param batchsize: number of videos per batch
+    :param rng: random number generator used for the permutations
+    :param pool_batches: number of batches sorted together, smaller pools are more random
+    :return: video idxs of the batch
+    """
+    seqlens = np.asarray(seqlens)
+    pool_size = batchsize * pool_batches
+    while True:
+        randomized = rng.permutation(len(seqlens))
+        batches = []
+        for start in range(0, len(randomized), pool_size):
+            pool = randomized[start:start + pool_size]
+            pool = pool[np.argsort(seqlens[pool], kind='mergesort')]
+            batches += [pool[i:i + batchsize] for i in range(0, len(pool), batchsize)]
+        for batch in rng.permutation(len(batches)):
+            yield batches[batch]
+
+
+def padding_ratio(seqlens, batches, pad_to_batch=True):
+    """
+    compute the fraction of padded timesteps over a list of batches
+    :param seqlens: lengths of video
+    :param batches: list of video idxs per batch
+    :param pad_to_batch: pad to the longest video of each batch instead of the longest video overall
+    :return: padded frames / total frames
+    """
+    seqlens = np.asarray(seqlens)
+    max_timesteps = np.max(seqlens)
+    total = 0
+    valid = 0
+    for batch in batches:
+        total += len(batch) * (np.max(seqlens[batch]) if pad_to_batch else max_timesteps)
+        valid += np.sum(seqlens[batch])
+    return 1.0 - float(valid) / total
+
+
+def padding_summary(seqlens, batchsize=30):
+    """
+    compare the padded frame ratio of one pass of random batches against length bucketed batches
+    :param seqlens: lengths of video
+    :param batchsize: number of videos per batch
+    :return: summary string
+    """
+    no_batches = int(np.ceil(len(seqlens) / float(batchsize)))
+    rng = np.random.RandomState(0)
+    idx_gen = gen_batch_idxs(len(seqlens), batchsize, rng=rng)
+    random_batches = [next(idx_gen) for _ in range(no_batches)]
+    bucket_gen = gen_bucket_batch_idxs(seqlens, batchsize, rng=rng)
+    bucket_batches = [next(bucket_gen) for _ in range(no_batches)]
+    return 'padded frames: {:.1f}% with dataset-wide padding, {:.1f}% with length bucketing'.format(
+        100 * padding_ratio(seqlens, random_batches, pad_to_batch=False),
+        100 * padding_ratio(seqlens, bucket_batches))
+
+
+def gen_lstm_batch_random(X, y, seqlen, batchsize=30, shuffle=True, reuse_buffer=False, bucket=False):
+    """
+    randomized data generator for training data
+    creates an infinite loop of mini batches
+    :param X: input
+    :param y: target
+    :param seqlen: lengths of video
+    :param batchsize: number of videos per batch
+    :param shuffle: permutate the videos every time all videos are used
+    :param reuse_buffer: fill the same preallocated batch array on every call, only for callers that consume
+                         each batch before asking for the next one, the batch is overwritten by the next batch
+    :param bucket: group videos of similar length and pad each batch to its own longest video
+    :return: x_train, y_target, input_mask, video idx used
+    """
+    # find the max len of all videos for creating the mask
+    seqlen = np.asarray(seqlen)
+    max_timesteps = np.max(seqlen)
+
+    # compute integral lengths of the video for fast offset access for data matrix
+    integral_lens = compute_integral_len(seqlen)
+    # frame index of every timestep of every video, used to gather a whole batch at once
+    gather_table, valid = compute_gather_table(seqlen, integral_lens, max_timesteps)
+    buffers = {}
+
+    if bucket:
+        idx_gen = gen_bucket_batch_idxs(seqlen, batchsize)
+    else:
+        idx_gen = gen_batch_idxs(len(seqlen), batchsize, shuffle)
+    for batch_video_idxs in idx_gen:
+        timesteps = np.max(seqlen[batch_video_idxs]) if bucket else max_timesteps
+        shape = (len(batch_video_idxs), timesteps) + X.shape[1:]
+        out = None
+        if reuse_buffer:
+            if shape not in buffers:
+                buffers[shape] = np.empty(shape, dtype=X.dtype)
+            out = buffers[shape]
+
+        # populate the batch X and batch y
+        valid_batch = valid[batch_video_idxs, :timesteps]
+        X_batch = gather_padded_batch(X, gather_table[batch_video_idxs, :timesteps], valid_batch, out)
+        y_batch = y[integral_lens[batch_video_idxs]].astype('uint8')
+        mask = valid_batch.astype('uint8')
         yield X_batch, y_batch, mask, batch_video_idxs
 
 
@@ -146,23 +230,108 @@ def gen_lstm_batch_seq(X, y, seqlen, batchsize=30):
 
 def compute_integral_len(lengths):
     # compute integral lengths of the video for fast offset access for data matrix
-    integral_lens = [0]
-    for i in range(1, len(lengths)):
-        integral_lens.append(integral_lens[i - 1] + lengths[i - 1])
+    lengths = np.asarray(lengths, dtype='int').reshape((-1,))
+    integral_lens = np.zeros_like(lengths)
+    np.cumsum(lengths[:-1], out=integral_lens[1:])
     return integral_lens
 
 
-def gen_seq_batch_from_idx(data, idxs, seqlens, integral_lens, max_timesteps):
-    feature_len = data.shape[-1]
-    X_batch = np.zeros((len(idxs), max_timesteps, feature_len), dtype=data.dtype)
+def compute_gather_table(seqlens, integral_lens, max_timesteps):
+    """
+    compute the data matrix row of every timestep of every sequence
+    padded timesteps point at the last frame of the sequence and are flagged as invalid
+    :param seqlens: lengths of the sequences
+    :param integral_lens: offsets of the sequences in the data matrix
+    :param max_timesteps: number of timesteps to pad the sequences to
+    :return: gather table of shape (sequences, max_timesteps), boolean valid mask of the same shape
+    """
+    seqlens = np.asarray(seqlens, dtype='int').reshape((-1, 1))
+    integral_lens = np.asarray(integral_lens, dtype='int').reshape((-1, 1))
+    steps = np.arange(max_timesteps).reshape((1, -1))
+    valid = steps < seqlens
+    gather_table = integral_lens + np.minimum(steps, np.maximum(seqlens - 1, 0))
+    return gather_table, valid
+
+
+def gather_padded_batch(data, gather_table, valid, out=None):
+    """
+    gather a zero padded batch of sequences from a data matrix with a single fancy index
+    :param data: data matrix of shape (frames, features)
+    :param gather_table: data matrix rows to gather, shape (batchsize, max_timesteps)
+    :param valid: boolean mask of the valid timesteps, shape (batchsize, max_timesteps)
+    :param out: optional preallocated array of shape (batchsize, max_timesteps, features) to fill
+    :return: batch of shape (batchsize, max_timesteps, features)
+    """
+    if out is None:
+        out = np.empty(gather_table.shape + data.shape[1:], dtype=data.dtype)
+    np.take(data, gather_table, axis=0, out=out, mode='clip')
+    out[~valid] = 0
+    return out
+
+
+def gen_seq_batch_from_idx(data, idxs, seqlens, integral_lens, max_timesteps, out=None):
+    """
+    gather the sequences of a batch from a data matrix, zero padded to max_timesteps
+    :param data: data matrix of shape (frames, features)
+    :param idxs: sequence indexes of the batch
+    :param seqlens: lengths of all sequences in data
+    :param integral_lens: offsets of all sequences in data
+    :param max_timesteps: number of timesteps to pad the sequences to
+    :param out: optional preallocated array of shape (len(idxs), max_timesteps, features) to fill
+    :return: batch of shape (len(idxs), max_timesteps, features)
+    """
+    gather_table, valid = compute_gather_table(np.asarray(seqlens)[idxs], np.asarray(integral_lens)[idxs],
+                                               max_timesteps)
+    return gather_padded_batch(data, gather_table, valid, out)
+
 
-    for i, seq_id in enumerate(idxs):
-        l = seqlens[seq_id]
-        start = integral_lens[seq_id]
-        end = start + l
-        X_batch[i] = np.concatenate([data[start:end],
-                                     np.zeros((max_timesteps - l, feature_len), dtype=data.dtype)])
-    return X_batch
+def check_pad_to(seqlens, pad_to):
+    """
+    :param seqlens: lengths of video
+    :param pad_to: number of timesteps the batches are padded to, None pads to the longest video
+    :raises ValueError: if a video is longer than pad_to
+    """
+    if pad_to is not None and len(seqlens) and np.max(seqlens) > pad_to:
+        raise ValueError('cannot pad videos of {} frames to {} timesteps'.format(np.max(seqlens), pad_to))
+
+
+def gen_eval_batches(y, seqlens, batchsize=32, pad_to=None):
+    """
+    split a multi-stream dataset into batches for evaluation
+    the videos are sorted by length, so every batch is padded to its own longest video and
+    videos of similar length share a batch. only the gather tables are kept, the inputs of a batch
+    are gathered from the data matrices with gather_eval_batch when the batch is evaluated
+    :param y: target
+    :param seqlens: lengths of video
+    :param batchsize: number of videos per batch, None puts all videos in one batch
+    :param pad_to: pad every batch to this number of timesteps instead, e.g. for a model with a fixed sequence length
+    :return: list of (gather table, y_target, input_mask, video idx used)
+    """
+    seqlens = np.asarray(seqlens)
+    check_pad_to(seqlens, pad_to)
+    integral_lens = compute_integral_len(seqlens)
+    order = np.argsort(-seqlens, kind='mergesort')
+    batchsize = batchsize or len(order)
+    batches = []
+    for start in range(0, len(order), batchsize):
+        batch_video_idxs = order[start:start + batchsize]
+        gather_table, valid = compute_gather_table(seqlens[batch_video_idxs], integral_lens[batch_video_idxs],
+                                                   pad_to or np.max(seqlens[batch_video_idxs]))
+        y_batch = y[integral_lens[batch_video_idxs]].astype('uint8')
+        batches.append((gather_table, y_batch, valid.astype('uint8'), batch_video_idxs))
+    return batches
+
+
+def gather_eval_batch(streams, gather_table, mask):
+    """
+    gather the inputs of an evaluation batch from gen_eval_batches
+    :param streams: list of data matrices, one per stream, with the same frame layout
+    :param gather_table: gather table of the batch
+    :param mask: input mask of the batch
+    :return: list of batches of shape (batchsize, max_timesteps, features), one per stream
+    """
+    valid = mask.astype(bool)
+    return [gather_padded_batch(X, gather_table, valid) for X in streams]
 
 
 def sequence_batch_iterator(X, y, seqlen, batchsize=30):
@@ -320,3 +489,104 @@ class SequenceBatchIterator(object):
             else:
                 start_seq = end_seq
             yield X_batch, y_batch, mask, batch_seq_idxs
+
+
+class MultiStreamBatchLoader(object):
+    def __init__(self, streams, y, seqlens, batchsize=30, shuffle=True, prefetch=4, bucket=False, pad_to=None):
+        """
+        randomized multi-stream data loader that prepares batches on a background thread
+        all streams share the same video order, so the batches of every stream stay aligned
+        creates an infinite loop of mini batches
+        :param streams: list of data matrices, one per stream, with the same frame layout
+        :param y: target
+        :param seqlens: lengths of video
+        :param batchsize: number of videos per batch
+        :param shuffle: permutate the videos every time all videos are used
+        :param prefetch: maximum number of batches prepared ahead of the training loop
+        :param bucket: group videos of similar length and pad each batch to its own longest video
+        :param pad_to: pad every batch to this number of timesteps, e.g. for a model with a fixed sequence length
+        """
+        self.streams = streams
+        self.y = y
+        self.seqlens = np.asarray(seqlens)
+        self.batchsize = batchsize
+        check_pad_to(self.seqlens, pad_to)
+        self.pad_to = pad_to
+        self.max_timesteps = pad_to or np.max(self.seqlens)
+        self.integral_lens = compute_integral_len(self.seqlens)
+        self.gather_table, self.valid = compute_gather_table(self.seqlens, self.integral_lens, self.max_timesteps)
+        # draw the permutation seed here so the video order only depends on the global numpy seed
+        self.rng = np.random.RandomState(np.random.randint(2 ** 31 - 1))
+        self.bucket = bucket
+        if bucket:
+            self.idx_gen = gen_bucket_batch_idxs(self.seqlens, batchsize, self.rng)
+        else:
+            self.idx_gen = gen_batch_idxs(len(self.seqlens), batchsize, shuffle, self.rng)
+
+        # queue starvation statistics
+        self.batches = 0
+        self.starved = 0
+        self.wait_time = 0.0
+
+        self._queue = queue.Queue(maxsize=prefetch)
+        self._stop = threading.Event()
+        self._worker = threading.Thread(target=self._fill_queue)
+        self._worker.daemon = True
+        self._worker.start()
+
+    def _make_batch(self, batch_video_idxs):
+        timesteps = np.max(self.seqlens[batch_video_idxs]) if self.bucket and not self.pad_to else self.max_timesteps
+        gather_table = self.gather_table[batch_video_idxs, :timesteps]
+        valid = self.valid[batch_video_idxs, :timesteps]
+        X_batches = [gather_padded_batch(X, gather_table, valid) for X in self.streams]
+        y_batch = self.y[self.integral_lens[batch_video_idxs]].astype('uint8')
+        mask = valid.astype('uint8')
+        return X_batches, y_batch, mask, batch_video_idxs
+
+    def _fill_queue(self):
+        try:
+            for batch_video_idxs in self.idx_gen:
+                item = self._make_batch(batch_video_idxs)
+                while not self._stop.is_set():
+                    try:
+                        self._queue.put(item, timeout=0.1)
+                        break
+                    except queue.Full:
+                        pass
+                if self._stop.is_set():
+                    return
+        except Exception as e:
+            # hand the error over to the training loop
+            self._queue.put(e)
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        return self.__next__()
+
+    def __next__(self):
+        """
+        get the next prepared batch
+        :return: list of stream batches, y_target, input_mask, video idx used
+        """
+        if self._queue.empty():
+            self.starved += 1
+        start = time.time()
+        item = self._queue.get()
+        self.wait_time += time.time() - start
+        if isinstance(item, Exception):
+            raise item
+        self.batches += 1
+        return item
+
+    def summary(self):
+        """
+        :return: string describing how often the training loop had to wait for input
+        """
+        return 'prefetch: {} batches, starved {} times ({:.1f}%), waited {:.2f}sec'.format(
+            self.batches, self.starved, 100.0 * self.starved / max(self.batches, 1), self.wait_time)
+
+    def close(self):
+        self._stop.set()
+        self._worker.join()
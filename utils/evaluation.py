@@ -0,0 +1,71 @@
+"""
+Sequence level scoring of the frame level predictions of the lstm models.
+"""
+import numpy as np
+
+DECISION_MODES = ['majority', 'mean_prob', 'last_frame']
+
+
+def count_votes(output, mask):
+    """
+    count the argmax predictions of the valid frames of every sequence
+    :param output: frame predictions of shape (num sequences, seq len, num classes)
+    :param mask: mask of shape (num sequences, seq len), nonzero for valid frames
+    :return: votes of shape (num sequences, num classes)
+    """
+    num_sequences, _, num_classes = output.shape
+    predictions = np.argmax(output, axis=-1)
+    # offset the predictions of every sequence so one bincount counts the votes of all sequences
+    predictions += np.arange(num_sequences)[:, np.newaxis] * num_classes
+    votes = np.bincount(predictions[mask.astype(bool)], minlength=num_sequences * num_classes)
+    return votes.reshape((num_sequences, num_classes))
+
+
+def sum_probabilities(output, mask):
+    """
+    sum the class probabilities of the valid frames of every sequence
+    :param output: frame predictions of shape (num sequences, seq len, num classes)
+    :param mask: mask of shape (num sequences, seq len), nonzero for valid frames
+    :return: summed probabilities of shape (num sequences, num classes)
+    """
+    return np.einsum('ntc,nt->nc', output, mask.astype(output.dtype))
+
+
+def last_frame_probabilities(output, mask):
+    """
+    :param output: frame predictions of shape (num sequences, seq len, num classes)
+    :param mask: mask of shape (num sequences, seq len), nonzero for valid frames
+    :return: class probabilities of the last valid frame of every sequence
+    """
+    seq_lens = np.sum(mask, axis=-1).astype('int')
+    return output[np.arange(len(output)), np.maximum(seq_lens - 1, 0)]
+
+
+def sequence_scores(output, mask, mode='majority'):
+    """
+    score the classes of every sequence
+    :param output: frame predictions of shape (num sequences, seq len, num classes)
+    :param mask: mask of shape (num sequences, seq len), nonzero for valid frames
+    :param mode: 'majority' counts the argmax votes of the frames, 'mean_prob' sums the class probabilities
+                 of the frames, 'last_frame' uses the class probabilities of the last frame
+    :return: scores of shape (num sequences, num classes), the predicted class has the highest score
+    """
+    if mode == 'majority':
+        return count_votes(output, mask)
+    elif mode == 'mean_prob':
+        return sum_probabilities(output, mask)
+    elif mode == 'last_frame':
+        return last_frame_probabilities(output, mask)
+    raise ValueError('decision mode must be one of {}, got {}'.format(', '.join(DECISION_MODES), mode))
+
+
+def confusion_matrix(targets, predictions, num_classes):
+    """
+    :param targets: target classes
+    :param predictions: predicted classes
+    :param num_classes: number of classes
+    :return: confusion matrix of shape (num classes, num classes), rows are targets, columns are predictions
+    """
+    matrix = np.zeros((num_classes, num_classes), dtype='int')
+    np.add.at(matrix, (targets, predictions), 1)
+    return matrix
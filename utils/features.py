@@ -0,0 +1,160 @@
+"""
+On-disk store of features extracted from the dataset .mat files.
+
+A feature chain is a comma separated list of transforms applied to the data matrix of a view, e.g.
+'reorder, dct(no_coeff=30), deltas(w=9)'. The chain runs once per view file and its output is stored
+next to the memory-mapped dataset cache (see utils.io), keyed by the source file contents, the image
+size and the transforms with their parameters.
+"""
+from __future__ import print_function
+import os
+import re
+import ast
+import json
+import shutil
+import hashlib
+import numpy as np
+
+from utils.io import DATASET_KEYS, convert_mat_dataset, load_dataset, _default_cache_dir
+from utils.preprocessing import reorder_data, compute_dct_features, concat_first_second_deltas
+
+# increase when the output of a transform changes, so that stale features are not reused
+FEATURE_STORE_VERSION = 1
+
+
+def _reorder(X, data, imagesize):
+    return reorder_data(X, imagesize)
+
+
+def _dct(X, data, imagesize, no_coeff=30, method='zigzag'):
+    return compute_dct_features(X, imagesize, no_coeff, method)
+
+
+def _deltas(X, data, imagesize, w=9):
+    return concat_first_second_deltas(X, data['videoLengthVec'].reshape((-1,)), w)
+
+
+TRANSFORMS = {
+    'reorder': _reorder,
+    'dct': _dct,
+    'deltas': _deltas,
+}
+
+
+def parse_features(spec):
+    """
+    parse a feature chain
+    :param spec: comma separated transforms with optional keyword arguments, e.g. 'dct(no_coeff=30), deltas'
+    :return: list of (transform name, parameter dict)
+    """
+    chain = []
+    for name, args in re.findall(r'(\w+)\s*(?:\(([^)]*)\))?', spec):
+        if name not in TRANSFORMS:
+            raise ValueError('unknown feature transform {}, use one of {}'.format(name, ', '.join(sorted(TRANSFORMS))))
+        params = {}
+        for arg in [a for a in args.split(',') if a.strip()]:
+            key, value = [s.strip() for s in arg.split('=')]
+            try:
+                params[key] = ast.literal_eval(value)
+            except (ValueError, SyntaxError):
+                params[key] = value
+        chain.append((name, params))
+    return chain
+
+
+def feature_key(source_digest, chain, imagesize):
+    """
+    :param source_digest: content hash of the source dataset
+    :param chain: feature chain from parse_features
+    :param imagesize: image size of the view
+    :return: hex digest identifying the extracted features
+    """
+    key = {
+        'version': FEATURE_STORE_VERSION,
+        'source': source_digest,
+        'chain': chain,
+        'imagesize': list(imagesize),
+    }
+    return hashlib.sha1(json.dumps(key, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def extract_features(path, spec, imagesize, cache_dir=None):
+    """
+    run a feature chain on a dataset .mat file and store the result, unless it is already stored
+    :param path: path to .mat file containing dataMatrix, targetsVec, subjectsVec and videoLengthVec
+    :param spec: feature chain, see parse_features
+    :param imagesize: image size of the view, e.g. (29, 50)
+    :param cache_dir: cache directory, defaults to 'cache' next to the .mat file
+    :return: path to the feature directory
+    """
+    if cache_dir is None:
+        cache_dir = _default_cache_dir(path)
+    chain = parse_features(spec)
+    source_dir = convert_mat_dataset(path, cache_dir)
+    source_digest = os.path.basename(source_dir).rsplit('.', 1)[-1]
+    out_dir = os.path.join(cache_dir, 'features.v{}'.format(FEATURE_STORE_VERSION), '{}.{}'.format(
+        os.path.splitext(os.path.basename(path))[0], feature_key(source_digest, chain, imagesize)))
+    if os.path.isdir(out_dir):
+        return out_dir
+
+    print('extracting {} features of {} to {}...'.format(spec, path, out_dir))
+    data = {}
+    for key in DATASET_KEYS:
+        data[key] = np.load(os.path.join(source_dir, '{}.npy'.format(key)), mmap_mode='r')
+    X = data['dataMatrix']
+    for name, params in chain:
+        X = TRANSFORMS[name](X, data, imagesize, **params)
+
+    # write to a temporary directory first so concurrent readers never see partial features
+    tmp_dir = '{}.tmp{}'.format(out_dir, os.getpid())
+    if os.path.isdir(tmp_dir):
+        shutil.rmtree(tmp_dir)
+    os.makedirs(tmp_dir)
+    np.save(os.path.join(tmp_dir, 'dataMatrix.npy'), np.asarray(X, dtype='float32'))
+    for key in DATASET_KEYS:
+        if key != 'dataMatrix':
+            np.save(os.path.join(tmp_dir, '{}.npy'.format(key)), data[key])
+    with open(os.path.join(tmp_dir, 'features.json'), 'w') as f:
+        json.dump({'source': path, 'features': spec, 'chain': chain, 'imagesize': list(imagesize)}, f)
+    try:
+        os.rename(tmp_dir, out_dir)
+    except OSError:
+        # another process finished the same extraction first
+        shutil.rmtree(tmp_dir)
+    return out_dir
+
+
+def load_features(path, spec, imagesize, cache_dir=None):
+    """
+    load the features of a dataset .mat file, extracting them on first use.
+    the feature matrix is memory-mapped read-only, the remaining vectors are loaded into memory.
+    :param path: path to .mat file containing dataMatrix, targetsVec, subjectsVec and videoLengthVec
+    :param spec: feature chain, see parse_features
+    :param imagesize: image size of the view, e.g. (29, 50)
+    :param cache_dir: cache directory, defaults to 'cache' next to the .mat file
+    :return: dictionary containing the dataset arrays with the features as dataMatrix
+    """
+    return load_dataset(extract_features(path, spec, imagesize, cache_dir))
+
+
+def main():
+    """
+    extract features of dataset .mat files ahead of running experiments
+    usage (from the package root):
+    python -m utils.features --features 'dct(no_coeff=30), deltas' --imagesize 29,50 oulu/data/allMouthROIsResized_frontal.mat
+    :return: None
+    """
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('files', nargs='+', help='[FILE] dataset .mat files to extract features from')
+    parser.add_argument('--features', required=True, help='[CHAIN] feature chain, e.g. dct(no_coeff=30),deltas')
+    parser.add_argument('--imagesize', required=True, help='[H,W] image size of the views')
+    parser.add_argument('--cache_dir', help='[DIR] cache directory')
+    args = parser.parse_args()
+    imagesize = tuple([int(d) for d in args.imagesize.split(',')])
+    for path in args.files:
+        print(extract_features(path, args.features, imagesize, args.cache_dir))
+
+
+if __name__ == '__main__':
+    main()
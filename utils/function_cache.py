@@ -0,0 +1,149 @@
+"""
+Cache of compiled theano functions shared between runs of the same model.
+
+Compiling the train and evaluation functions of the multi-stream models takes a large share
+of a short run, and the experiment scripts compile the same graphs once per repeat.
+The compiled functions are pickled after the first compilation and unpickled without
+re-optimizing the graph in later runs. The parameters of the freshly built network share
+their storage with the unpickled functions, so training updates and saved models refer to
+the same values as before.
+"""
+from __future__ import print_function
+import os
+import sys
+import json
+import time
+import hashlib
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+import theano
+import lasagne as las
+
+from utils.io import makedirs
+
+# increase when a layer or model builder changes the graph it computes, so that stale functions are not reused
+FUNCTION_CACHE_VERSION = 1
+THEANO_FLAGS = ['floatX', 'device', 'mode', 'optimizer', 'cxx', 'linker']
+
+
+def network_signature(network):
+    """
+    describe the topology of a network, the layer types, names, output shapes, nonlinearities
+    and parameter shapes of every layer
+    :param network: output layer of the network
+    :return: list of layer descriptions
+    """
+    signature = []
+    for layer in las.layers.get_all_layers(network):
+        nonlinearity = getattr(layer, 'nonlinearity', None)
+        signature.append([type(layer).__name__, layer.name,
+                          str(layer.output_shape),
+                          getattr(nonlinearity, '__name__', str(nonlinearity)),
+                          [(p.name, p.get_value(borrow=True).shape) for p in layer.get_params()]])
+    return signature
+
+
+def cache_key(network, extra=None):
+    """
+    compute the cache key of a network
+    :param network: output layer of the network
+    :param extra: other json serializable values the compiled graph depends on, e.g. learning rate
+    :return: hex digest
+    """
+    flags = [(flag, str(getattr(theano.config, flag, None))) for flag in THEANO_FLAGS]
+    key = {
+        'version': FUNCTION_CACHE_VERSION,
+        'theano': theano.__version__,
+        'python': sys.version_info[:2],
+        'flags': flags,
+        'network': network_signature(network),
+        'extra': extra,
+    }
+    return hashlib.sha1(json.dumps(key, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+class FunctionCache(object):
+    """
+    Compiles the theano functions of a network, or loads them from a cache directory
+    """
+    def __init__(self, network, cache_dir=None, extra=None):
+        """
+        Constructs a function cache
+        :param network: output layer of the network the functions are compiled for
+        :param cache_dir: directory to store the compiled functions, None disables caching
+        :param extra: other json serializable values the compiled graphs depend on
+        """
+        self.params = las.layers.get_all_params(network)
+        self.cache_dir = cache_dir
+        self.key = cache_key(network, extra) if cache_dir else None
+        self.stats = []
+
+    def path(self, names):
+        return os.path.join(self.cache_dir, '{}.{}.pkl'.format('-'.join(names), self.key))
+
+    def compile(self, builders):
+        """
+        compile a group of functions or load them from the cache
+        the functions are stored in one file so that they keep sharing the network parameters
+        :param builders: list of (name, build_fn) pairs, build_fn compiles and returns a theano function
+        :return: list of theano functions using the current network parameters
+        """
+        names = [name for name, _ in builders]
+        if self.cache_dir and os.path.exists(self.path(names)):
+            start = time.time()
+            try:
+                fns = self._load(names)
+                self.stats.append((', '.join(names), True, time.time() - start))
+                return fns
+            except Exception as e:
+                print('could not load cached functions {}: {}'.format(', '.join(names), e))
+
+        fns = []
+        for name, build_fn in builders:
+            start = time.time()
+            fns.append(build_fn())
+            self.stats.append((name, False, time.time() - start))
+        if self.cache_dir:
+            self._save(names, fns)
+        return fns
+
+    def _save(self, names, fns):
+        # several runs can share the cache directory and save into it at the same time
+        makedirs(self.cache_dir)
+        tmp_path = '{}.{}.tmp'.format(self.path(names), os.getpid())
+        with open(tmp_path, 'wb') as f:
+            pickle.dump((fns, self.params), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.rename(tmp_path, self.path(names))
+
+    def _load(self, names):
+        reoptimize = theano.config.reoptimize_unpickled_function
+        theano.config.reoptimize_unpickled_function = False
+        try:
+            with open(self.path(names), 'rb') as f:
+                fns, params = pickle.load(f)
+        finally:
+            theano.config.reoptimize_unpickled_function = reoptimize
+        if [p.name for p in params] != [p.name for p in self.params]:
+            raise ValueError('parameters do not match the network')
+        # the unpickled functions hold their own copies of the parameters, load the current values
+        # into them and let the network parameters share their storage.
+        # optimizer state (e.g. adam moments) keeps the pickled initial values
+        for param, cached_param in zip(self.params, params):
+            cached_param.set_value(param.get_value(borrow=True))
+            param.container = cached_param.container
+        return fns
+
+    def summary(self):
+        """
+        :return: string reporting the compile or load time of every function and the number of cache hits
+        """
+        lines = ['{} {} in {:.1f}sec'.format(name, 'loaded from cache' if hit else 'compiled', seconds)
+                 for name, hit, seconds in self.stats]
+        hits = sum(1 for _, hit, _ in self.stats if hit)
+        lines.append('function cache: {} loaded, {} compiled, {:.1f}sec total'.format(
+            hits, len(self.stats) - hits, sum(seconds for _, _, seconds in self.stats)))
+        return '\n'.join(lines)
@@ -1,4 +1,10 @@
+import os
 import sys
+import json
+import errno
+import shutil
+import hashlib
+import numpy as np
 import scipy.io as sio
 import lasagne as las
 sys.path.insert(0, '../')
@@ -24,6 +30,130 @@ def load_mat_file(path):
     return sio.loadmat(path)
 
 
+DATASET_KEYS = ('dataMatrix', 'targetsVec', 'subjectsVec', 'videoLengthVec')
+
+
+def file_hash(path, blocksize=1 << 20):
+    """
+    compute the sha1 digest of a file's contents
+    :param path: path to file
+    :param blocksize: number of bytes to read at a time
+    :return: hex digest
+    """
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as f:
+        block = f.read(blocksize)
+        while block:
+            sha1.update(block)
+            block = f.read(blocksize)
+    return sha1.hexdigest()
+
+
+def makedirs(path):
+    """
+    create a directory and its parents, another process creating the same directory first is not an error
+    :param path: directory to create
+    """
+    try:
+        os.makedirs(path)
+    except OSError as e:
+        if e.errno != errno.EEXIST or not os.path.isdir(path):
+            raise
+
+
+def _default_cache_dir(path):
+    return os.path.join(os.path.dirname(os.path.abspath(path)), 'cache')
+
+
+def _source_digest(path, cache_dir):
+    """
+    find the content hash of a source file, only rehashing it when its size or mtime changed
+    :param path: path to source file
+    :param cache_dir: cache directory holding the stamp files
+    :return: hex digest of the source file
+    """
+    stat = os.stat(path)
+    stamp_path = os.path.join(cache_dir, os.path.basename(path) + '.stamp')
+    try:
+        with open(stamp_path) as f:
+            stamp = json.load(f)
+        if stamp['size'] == stat.st_size and stamp['mtime'] == stat.st_mtime:
+            return stamp['sha1']
+    except (IOError, ValueError, KeyError):
+        # a missing or unreadable stamp is a cache miss
+        pass
+    digest = file_hash(path)
+    makedirs(cache_dir)
+    # write to a temporary file first so concurrent readers never see a partial stamp
+    tmp_path = '{}.tmp{}'.format(stamp_path, os.getpid())
+    with open(tmp_path, 'w') as f:
+        json.dump({'size': stat.st_size, 'mtime': stat.st_mtime, 'sha1': digest}, f)
+    try:
+        os.rename(tmp_path, stamp_path)
+    except OSError:
+        # another process wrote the same stamp first
+        os.remove(tmp_path)
+    return digest
+
+
+def convert_mat_dataset(path, cache_dir=None):
+    """
+    convert a dataset .mat file to a directory of .npy files that can be memory-mapped.
+    dataMatrix is stored as float32, the remaining vectors keep their original dtype.
+    :param path: path to .mat file containing dataMatrix, targetsVec, subjectsVec and videoLengthVec
+    :param cache_dir: directory to write the converted dataset to, defaults to 'cache' next to the .mat file
+    :return: path to the converted dataset directory
+    """
+    if cache_dir is None:
+        cache_dir = _default_cache_dir(path)
+    digest = _source_digest(path, cache_dir)
+    out_dir = os.path.join(cache_dir, '{}.{}'.format(os.path.splitext(os.path.basename(path))[0], digest))
+    if os.path.isdir(out_dir):
+        return out_dir
+
+    print('converting {} to {}...'.format(path, out_dir))
+    data = load_mat_file(path)
+    # write to a temporary directory first so concurrent readers never see a partial conversion
+    tmp_dir = '{}.tmp{}'.format(out_dir, os.getpid())
+    if os.path.isdir(tmp_dir):
+        shutil.rmtree(tmp_dir)
+    os.makedirs(tmp_dir)
+    for key in DATASET_KEYS:
+        value = data[key].astype('float32') if key == 'dataMatrix' else data[key]
+        np.save(os.path.join(tmp_dir, '{}.npy'.format(key)), value)
+    try:
+        os.rename(tmp_dir, out_dir)
+    except OSError:
+        # another process finished the same conversion first
+        shutil.rmtree(tmp_dir)
+    return out_dir
+
+
+def load_mat_dataset(path, cache_dir=None):
+    """
+    load a dataset .mat file through the converted cache, converting it on first use.
+    dataMatrix is memory-mapped read-only so the page cache is shared between processes,
+    the remaining (small) vectors are loaded into memory.
+    :param path: path to .mat file containing dataMatrix, targetsVec, subjectsVec and videoLengthVec
+    :param cache_dir: directory holding the converted dataset, defaults to 'cache' next to the .mat file
+    :return: dictionary containing the dataset arrays
+    """
+    return load_dataset(convert_mat_dataset(path, cache_dir))
+
+
+def load_dataset(out_dir):
+    """
+    load a converted dataset directory, dataMatrix is memory-mapped read-only
+    :param out_dir: dataset directory from convert_mat_dataset
+    :return: dictionary containing the dataset arrays
+    """
+    data = {}
+    for key in DATASET_KEYS:
+        mmap_mode = 'r' if key == 'dataMatrix' else None
+        data[key] = np.load(os.path.join(out_dir, '{}.npy'.format(key)), mmap_mode=mmap_mode)
+    return data
+
+
 def save_mat(dict, path):
     print('save matlab file...')
     sio.savemat(path, dict)
@@ -46,3 +176,22 @@ def load_model_params(network, path):
     all_param_values = pickle.load(open(path, 'rb'))
     las.layers.set_all_param_values(network, all_param_values)
     return network
+
+
+def main():
+    """
+    convert dataset .mat files to the memory-mapped cache ahead of running experiments
+    usage (from the package root): python -m utils.io oulu/data/allMouthROIsResized_frontal.mat ...
+    :return: None
+    """
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('files', nargs='+', help='[FILE] dataset .mat files to convert')
+    parser.add_argument('--cache_dir', help='[DIR] directory to write the converted datasets to')
+    args = parser.parse_args()
+    for path in args.files:
+        print(convert_mat_dataset(path, args.cache_dir))
+
+
+if __name__ == '__main__':
+    main()
@@ -7,6 +7,8 @@ import scipy.signal as signal
 import scipy.fftpack as fft
 from scipy.misc import imresize
 
+from utils.segments import segment_offsets, segment_mean, segment_deltas, segment_resize_index
+
 
 def test_delta():
     a = np.array([[1,1,1,1,1,1,1,1,10], [2,2,2,2,2,2,2,2,20], [3,3,3,3,3,3,3,3,30], [4,4,4,4,4,4,4,4,40]])
@@ -108,7 +110,40 @@ def split_data(data_matrix, split_idx, len_vec=None):
         return split
 
 
-def split_seq_data(X, y, subjects, video_lens, train_ids, val_ids, test_ids):
+def create_seq_split_index(subjects, video_lens, train_ids, val_ids, test_ids):
+    """
+    Computes the frame and video indexes of the training, validation and testing splits
+    in a single vectorized pass. The index only depends on the subject and video length
+    vectors, so it can be computed once and shared by all streams of an experiment.
+    :param subjects: array of video -> subject mapping
+    :param video_lens: array of video lengths for each video
+    :param train_ids: list of subject ids used for training
+    :param val_ids: list of subject ids used for validation
+    :param test_ids: list of subject ids used for testing
+    :return: list of (frame indexes, video indexes) tuples for the train, val and test splits
+    """
+    subjects = np.asarray(subjects).reshape((-1,))
+    video_lens = np.asarray(video_lens).reshape((-1,)).astype('int')
+    split_index = []
+    for ids in (train_ids, val_ids, test_ids):
+        video_mask = np.in1d(subjects, ids)
+        # expand the per video selection to every frame of the video
+        frame_mask = np.repeat(video_mask, video_lens)
+        split_index.append((np.flatnonzero(frame_mask), np.flatnonzero(video_mask)))
+    return split_index
+
+
+def apply_seq_split(X, split_index):
+    """
+    Gathers the frames of each split from a data matrix
+    :param X: data matrix of shape (frames, features)
+    :param split_index: split index computed by create_seq_split_index
+    :return: train, val and test data matrices
+    """
+    return tuple(np.take(X, frame_idxs, axis=0) for frame_idxs, _ in split_index)
+
+
+def split_seq_data(X, y, subjects, video_lens, train_ids, val_ids, test_ids, split_index=None):
     """
     Splits the data into training and testing sets
     :param X: input X
@@ -118,63 +153,34 @@ def split_seq_data(X, y, subjects, video_lens, train_ids, val_ids, test_ids):
     :param train_ids: list of subject ids used for training
     :param val_ids: list of subject ids used for validation
     :param test_ids: list of subject ids used for testing
+    :param split_index: precomputed split index from create_seq_split_index, computed if not given
     :return: split data
     """
-    # construct a subjects data matrix offset
-    X_feature_dim = X.shape[1]
-    train_X = np.empty((0, X_feature_dim), dtype='float32')
-    val_X = np.empty((0, X_feature_dim), dtype='float32')
-    test_X = np.empty((0, X_feature_dim), dtype='float32')
-    train_y = np.empty((0,), dtype='int')
-    val_y = np.empty((0,), dtype='int')
-    test_y = np.empty((0,), dtype='int')
-    train_vidlens = np.empty((0,), dtype='int')
-    val_vidlens = np.empty((0,), dtype='int')
-    test_vidlens = np.empty((0,), dtype='int')
-    train_subjects = np.empty((0,), dtype='int')
-    val_subjects = np.empty((0,), dtype='int')
-    test_subjects = np.empty((0,), dtype='int')
-    previous_subject = 1
-    subject_video_count = 0
-    current_video_idx = 0
-    current_data_idx = 0
-    populate = False
-    for idx, subject in enumerate(subjects):
-        if previous_subject == subject:  # accumulate
-            subject_video_count += 1
-        else:  # populate the previous subject
-            populate = True
-        if idx == len(subjects) - 1:  # check if it is the last entry, if so populate
-            populate = True
-            previous_subject = subject
-        if populate:
-            # slice the data into the respective splits
-            end_video_idx = current_video_idx + subject_video_count
-            subject_data_len = int(np.sum(video_lens[current_video_idx:end_video_idx]))
-            end_data_idx = current_data_idx + subject_data_len
-            if previous_subject in train_ids:
-                train_X = np.concatenate((train_X, X[current_data_idx:end_data_idx]))
-                train_y = np.concatenate((train_y, y[current_data_idx:end_data_idx]))
-                train_vidlens = np.concatenate((train_vidlens, video_lens[current_video_idx:end_video_idx]))
-                train_subjects = np.concatenate((train_subjects, subjects[current_video_idx:end_video_idx]))
-            if previous_subject in val_ids:
-                val_X = np.concatenate((val_X, X[current_data_idx:end_data_idx]))
-                val_y = np.concatenate((val_y, y[current_data_idx:end_data_idx]))
-                val_vidlens = np.concatenate((val_vidlens, video_lens[current_video_idx:end_video_idx]))
-                val_subjects = np.concatenate((val_subjects, subjects[current_video_idx:end_video_idx]))
-            if previous_subject in test_ids:
-                test_X = np.concatenate((test_X, X[current_data_idx:end_data_idx]))
-                test_y = np.concatenate((test_y, y[current_data_idx:end_data_idx]))
-                test_vidlens = np.concatenate((test_vidlens, video_lens[current_video_idx:end_video_idx]))
-                test_subjects = np.concatenate((test_subjects, subjects[current_video_idx:end_video_idx]))
-            previous_subject = subject
-            current_video_idx = end_video_idx
-            current_data_idx = end_data_idx
-            subject_video_count = 1
-            populate = False
-    return train_X, train_y, train_vidlens, train_subjects, \
-           val_X, val_y, val_vidlens, val_subjects, \
-           test_X, test_y, test_vidlens, test_subjects
+    if split_index is None:
+        split_index = create_seq_split_index(subjects, video_lens, train_ids, val_ids, test_ids)
+    split = []
+    labels = split_seq_labels(y, subjects, video_lens, split_index)
+    for i, (frame_idxs, _) in enumerate(split_index):
+        split.append(np.take(X, frame_idxs, axis=0))
+        split.extend(labels[i * 3:i * 3 + 3])
+    return tuple(split)
+
+
+def split_seq_labels(y, subjects, video_lens, split_index):
+    """
+    Splits the targets, video lengths and subjects into training, validation and testing sets
+    :param y: target y
+    :param subjects: array of video -> subject mapping
+    :param video_lens: array of video lengths for each video
+    :param split_index: split index computed by create_seq_split_index
+    :return: (y, video lengths, subjects) of the train, val and test splits
+    """
+    split = []
+    for frame_idxs, video_idxs in split_index:
+        split.append(np.take(y, frame_idxs, axis=0).astype('int'))
+        split.append(np.take(video_lens, video_idxs, axis=0).astype('int'))
+        split.append(np.take(subjects, video_idxs, axis=0).astype('int'))
+    return tuple(split)
 
 
 def resize_img(img, orig_dim=(60, 80), dim=(30, 40), reshape=True, order='F'):
@@ -215,36 +221,35 @@ def resize_images(images, orig_dim=(60, 80), dim=(30, 40), reshape=True, order='
     return resized
 
 
-def normalize_input(input, centralize=True, quantize=False):
+def normalize_input(input, centralize=True, quantize=False, chunksize=8192):
     """
     samplewise normalize input
+    the rows are normalized in place in chunks of rows, non floating point input is converted to float32 first
     :param input: input features
     :param centralize: apply 0 mean, std 1
-    :param quantize: rescale values to fall between 0 and 1
+    :param quantize: rescale values to fall between 0 and 1, takes precedence over centralize
+    :param chunksize: number of rows normalized at once, None normalizes all rows at once
     :return: normalized input
     """
-    def center(item):
-        item = item - item.mean()
-        std = np.std(item)
-        if std == 0:
-            std = 1.00
-        item = item / std
-        return item
-
-    def rescale(item):
-        min = np.min(item)
-        max = np.max(item)
-        dif = max - min
-        if dif == 0:
-            dif = 1.00
-        item = (item - min) / dif
-        return item
-
-    for i, item in enumerate(input):
-        if centralize:
-            input[i] = center(item)
+    if not np.issubdtype(input.dtype, np.floating):
+        input = input.astype('float32')
+    if not centralize and not quantize:
+        return input
+    chunksize = chunksize or max(len(input), 1)
+    axes = tuple(range(1, input.ndim))
+    broadcast = (-1,) + (1,) * len(axes)
+    for start in range(0, len(input), chunksize):
+        chunk = input[start:start + chunksize]
         if quantize:
-            input[i] = rescale(item)
+            offset = np.min(chunk, axis=axes)
+            scale = np.max(chunk, axis=axes) - offset
+        else:
+            offset = np.mean(chunk, axis=axes, dtype=np.float64)
+            scale = np.std(chunk, axis=axes, dtype=np.float64)
+        # constant rows are only shifted
+        scale[scale == 0] = 1.0
+        chunk -= offset.astype(input.dtype).reshape(broadcast)
+        chunk /= scale.astype(input.dtype).reshape(broadcast)
     return input
 
 
@@ -263,24 +268,53 @@ def featurewise_normalize_sequence(input):
     return input, feature_means, feature_std
 
 
+def featurewise_mean_std(input, chunksize=None):
+    """
+    compute the feature means and standard deviations of an input, a chunk of rows at a time
+    :param input: an input matrix of shape (input no, feature)
+    :param chunksize: number of rows processed at once, None processes all rows at once
+    :return: feature mean, feature std in float32
+    """
+    chunksize = chunksize or max(len(input), 1)
+    total = np.zeros(input.shape[1:], dtype=np.float64)
+    for start in range(0, len(input), chunksize):
+        total += np.sum(input[start:start + chunksize], axis=0, dtype=np.float64)
+    feature_means = total / len(input)
+    total[:] = 0
+    for start in range(0, len(input), chunksize):
+        total += np.sum(np.square(input[start:start + chunksize] - feature_means), axis=0)
+    feature_std = np.sqrt(total / len(input))
+    return feature_means.astype('float32'), feature_std.astype('float32')
+
+
+def apply_featurewise_normalization(input, feature_means, feature_std, chunksize=None):
+    """
+    z-normalize the features of an input in place, a chunk of rows at a time
+    :param input: an input matrix of shape (input no, feature)
+    :param feature_means: feature means
+    :param feature_std: feature standard deviations
+    :param chunksize: number of rows processed at once, None processes all rows at once
+    :return: normalized input
+    """
+    chunksize = chunksize or max(len(input), 1)
+    for start in range(0, len(input), chunksize):
+        chunk = input[start:start + chunksize]
+        chunk -= feature_means
+        chunk /= feature_std
+    return input
+
+
 def sequencewise_mean_image_subtraction(input, seqlens, axis=0):
     """
     sequence-wise mean image removal
     :param input: input sequences
     :param seqlens: sequence lengths
-    :param axis: axis to apply mean image removal
-    :return: mean removed input sequences
+    :param axis: axis to apply mean image removal, only the frame axis 0 is supported
+    :return: mean removed input sequences in float32
     """
-    mean_subtracted = np.zeros(input.shape, input.dtype)
-    start = 0
-    end = 0
-    for len in seqlens:
-        end += len
-        seq = input[start:end, :]
-        mean_image = np.sum(seq, axis, input.dtype) / len
-        mean_subtracted[start:end, :] = seq - mean_image
-        start += len
-    return mean_subtracted
+    assert axis == 0
+    mean_images = segment_mean(input, seqlens).astype('float32', copy=False)
+    return np.subtract(input, np.repeat(mean_images, seqlens, axis=0), dtype='float32')
 
 
 def zigzag(X):
@@ -294,54 +328,25 @@ def zigzag(X):
     :param X: 2D array
     :return: 1D array containing elements of X arranged in the traversal sequence
     """
-    rows, cols = X.shape
-    size = rows * cols
-    out = np.zeros((rows * cols, ), dtype=X.dtype)
-    cur_row = 0
-    cur_col = 0
-    direction = 0
-    DOWN = 1
-    UP = 0
+    return X.ravel()[zigzag_index(X.shape)]
 
-    for i in range(size):
-        out[i] = X[cur_row][cur_col]
-        if cur_row == 0:
-            if cur_col % 2:  # odd, move diagonal down
-                direction = DOWN
-                cur_row += 1
-                cur_col -= 1
-            else:
-                if cur_col == cols - 1:  # no more cols to move, go down
-                    direction = DOWN
-                    cur_row += 1
-                else:
-                    cur_col += 1  # even, move right
-        elif cur_col == 0:
-            if cur_row % 2:
-                if cur_row == rows - 1:  # no more rows to move down, move right
-                    direction = UP
-                    cur_col += 1
-                else:
-                    cur_row += 1
-            else:
-                direction = UP
-                cur_row -= 1
-                cur_col += 1
-        elif direction == UP:
-            if cur_col == cols - 1:  # no more cols to move up
-                direction = DOWN
-                cur_row += 1
-            else:
-                cur_row -= 1
-                cur_col += 1
-        else:
-            if cur_row == rows - 1:  # no more rows to move down
-                direction = UP
-                cur_col += 1
-            else:
-                cur_row += 1
-                cur_col -= 1
-    return out
+
+def zigzag_index(shape):
+    """
+    compute the zigzag traversal of a 2D array as a permutation of its flattened 'c' order indices,
+    the permutation is computed once per shape
+    :param shape: shape of 2D array
+    :return: 1D array of flat indices in the traversal sequence
+    """
+    shape = tuple(shape)
+    if shape not in _zigzag_indices:
+        index = np.argsort(fill_zigzag(shape).ravel())
+        index.flags.writeable = False
+        _zigzag_indices[shape] = index
+    return _zigzag_indices[shape]
+
+
+_zigzag_indices = {}
 
 
 def fill_zigzag(shape):
@@ -430,14 +435,14 @@ def compute_dct_features(X, image_shape, no_coeff=30, method='zigzag'):
     :param method: method to extract coefficents, zigzag, variance
     :return: dct features
     """
-    X_dct = fft.dct(X, norm='ortho')
+    # 2D dct of all images, along the image columns then the image rows
+    X_dct = X.reshape((-1,) + tuple(image_shape))
+    X_dct = fft.dct(fft.dct(X_dct, axis=2, norm='ortho'), axis=1, norm='ortho')
+    X_dct = X_dct.reshape((len(X_dct), -1))
 
     if method == 'zigzag':
-        out = np.zeros((len(X_dct), no_coeff), dtype=X_dct.dtype)
-        for i in xrange(len(X_dct)):
-            image = X_dct[i].reshape(image_shape)
-            out[i] = zigzag(image)[1:no_coeff + 1]
-        return out
+        # skip the DC coefficient
+        return X_dct[:, zigzag_index(image_shape)[1:no_coeff + 1]]
     elif method == 'rel_variance':
         X_dct = X_dct[:, 1:]
         # mean coefficient per frequency
@@ -474,24 +479,13 @@ def concat_first_second_deltas(X, vidlenvec, w=9):
     :param X: input feature vector X
     :param vidlenvec: temporal sequence of X
     :param w: window size, defaults to 9
-    :return: A matrix of shape(num rows of intput X, X + 1st order X + 2nd order X)
+    :return: A matrix of shape(num rows of intput X, X + 1st order X + 2nd order X) in float32
     """
-    # construct a new feature matrix
     feature_len = X.shape[1]
-    Y = np.zeros((X.shape[0], feature_len * 3))  # new feature vector with 1st, 2nd delta
-    start = 0
-    for vidlen in vidlenvec:
-        end = start + vidlen
-        seq = X[start: end]  # (vidlen, feature_len)
-        first_order = deltas(seq.T, w)
-        second_order = deltas(first_order, w)
-        assert first_order.shape == (feature_len, vidlen)
-        assert second_order.shape == (feature_len, vidlen)
-        assert len(seq) == vidlen
-        seq = np.concatenate((seq, first_order.T, second_order.T), axis=1)
-        for idx, j in enumerate(range(start, end)):
-            Y[j] = seq[idx]
-        start += vidlen
+    Y = np.empty((X.shape[0], feature_len * 3), dtype='float32')  # new feature vector with 1st, 2nd delta
+    Y[:, :feature_len] = X
+    Y[:, feature_len:feature_len * 2] = segment_deltas(X, vidlenvec, w)
+    Y[:, feature_len * 2:] = segment_deltas(Y[:, feature_len:feature_len * 2], vidlenvec, w)
     return Y
 
 
@@ -510,16 +504,22 @@ def reorder_data(X, shape, orig_order='f', desired_order='c'):
 
 
 def compute_diff_images(X, vidlenvec):
-
-    diff_X = np.zeros(X.shape, dtype=X.dtype)
-    start = 0
-    for l in vidlenvec:
-        end = start + l
-        seq = X[start:end]
-        diff_seq = np.diff(seq, 1, 0)
-        diff_X[start] = diff_seq[0]  # copy the 1st diff image
-        diff_X[start+1:end] = diff_seq
-        start = end
+    """
+    compute the difference images of every sequence, the first frame of a sequence gets the
+    difference image of the second frame
+    :param X: input sequences
+    :param vidlenvec: sequence lengths
+    :return: difference images in float32
+    """
+    diff_X = np.empty(X.shape, dtype='float32')
+    np.subtract(X[1:], X[:-1], out=diff_X[1:])
+    # the first frame of every sequence differs with the last frame of the previous one, replace it
+    # with the 1st diff image. single frame sequences have no difference image and are set to 0
+    vidlenvec = np.asarray(vidlenvec)
+    starts = segment_offsets(vidlenvec)[:-1]
+    diff_X[starts[vidlenvec == 1]] = 0
+    starts = starts[vidlenvec > 1]
+    diff_X[starts] = diff_X[starts + 1]
     return diff_X
 
 
@@ -618,53 +618,7 @@ def force_align(x1, x2, mode='fill'):
     :param mode: 'fill', 'discard'
     :return: x1, x2 streams forced aligned
     """
-    x1, x1_targets, x1_lens = x1
-    x2, x2_targets, x2_lens = x2
-    x1_new = []
-    x1_targets_new = []
-    x2_new = []
-    x2_targets_new = []
-    x1_curr_idx = 0
-    x2_curr_idx = 0
-    for i, l1 in enumerate(x1_lens):
-        l2 = x2_lens[i]
-        difference = l1 - l2
-        if mode == 'fill':
-            if difference < 0:
-                '''fill x1 with difference'''
-                difference = abs(difference)
-                for j in range(l1):
-                    x1_new.append(x1[x1_curr_idx + j])
-                    x1_targets_new.append(x1_targets[x1_curr_idx + j])
-                '''[0][1][2][3]'''
-                last_element = x1[x1_curr_idx + l1 - 1]
-                last_element_target = x1_targets[x1_curr_idx + l1 - 1]
-                for j in range(difference):
-                    x1_new.append(np.copy(last_element))
-                    x1_targets_new.append(np.copy(last_element_target))
-                x1_lens[i] = l1 + difference  # update the lens
-                for j in range(l2):
-                    x2_new.append(x2[x2_curr_idx + j])
-                    x2_targets_new.append(x2_targets[x2_curr_idx + j])
-            else:
-                '''fill x2 with difference'''
-                for j in range(l2):
-                    x2_new.append(x2[x2_curr_idx + j])
-                    x2_targets_new.append(x2_targets[x2_curr_idx + j])
-                '''[0][1][2][3]'''
-                last_element = x2[x2_curr_idx + l1 - 1]
-                last_element_target = x2_targets[x2_curr_idx + l2 - 1]
-                for j in range(difference):
-                    x2_new.append(np.copy(last_element))
-                    x2_targets_new.append(np.copy(last_element_target))
-                x2_lens[i] = l2 + difference  # update the lens
-                for j in range(l1):
-                    x1_new.append(x1[x1_curr_idx + j])
-                    x1_targets_new.append(x1_targets[x1_curr_idx + j])
-            x1_curr_idx += l1
-            x2_curr_idx += l2
-        # TODO: discard mode
-    return (np.array(x1_new), np.array(x1_targets_new), x1_lens), (np.array(x2_new), np.array(x2_targets_new), x2_lens)
+    return tuple(multistream_force_align([x1, x2], mode))
 
 
 def extract_stream_elements(streams):
@@ -680,39 +634,22 @@ def multistream_force_align(orig_streams, mode='fill'):
     """
     force align multiple streams to be of the same length
     :param orig_streams: original streams in a list of tuple (input, target, input_lens)
-    :param mode: 'fill', 'discard' missing or excess data
+    :param mode: 'fill' pads the shorter sequences with their last frame,
+                 'discard' removes the excess frames of the longer sequences
     :return: list of new streams of tuple (new_input, new_target, new_lens)
     """
-    INPUT_IDX = 0
-    TARGET_IDX = 1
-    LEN_IDX = 2
-    new_streams = [([], [], s[2]) for s in orig_streams]
-    curr_idxs = [0]*len(orig_streams)
     inputs, targets, input_lens = extract_stream_elements(orig_streams)
-    # for each sequence
-    for i, l1 in enumerate(input_lens[0]):
-        # compute the lens, find stream with longest length
-        lens = [input_len_vec[i] for input_len_vec in input_lens]
-        max_idx = np.argmax(lens)
-        # compute the number of copies to generate
-        copies_to_make = [input_lens[max_idx][i] - l[i] for l in input_lens]
-        # for each stream, append the original stream and copies to make to new stream
-        for j in range(len(orig_streams)):
-            input_vec = inputs[j]
-            target_vec = targets[j]
-            l = lens[j]  # length of sequence for current stream
-            for k in range(l):
-                new_streams[j][INPUT_IDX].append(input_vec[curr_idxs[j] + k])
-                new_streams[j][TARGET_IDX].append(target_vec[curr_idxs[j] + k])
-            copies = copies_to_make[j]
-            # make copies to fill shorter streams
-            for k in range(copies):
-                last_element = input_vec[curr_idxs[j] + l - 1]
-                last_element_target = target_vec[curr_idxs[j] + l - 1]
-                new_streams[j][INPUT_IDX].append(np.copy(last_element))
-                new_streams[j][TARGET_IDX].append(np.copy(last_element_target))
-            new_streams[j][LEN_IDX][i] = l + copies
-            curr_idxs[j] += l
-    # convert the lists to numpy arrays
-    new_streams = [(np.array(x[INPUT_IDX]), np.array(x[TARGET_IDX]), x[LEN_IDX]) for x in new_streams]
+    input_lens = [np.asarray(lens) for lens in input_lens]
+    if mode == 'fill':
+        aligned_lens = np.max(input_lens, axis=0)
+    elif mode == 'discard':
+        aligned_lens = np.min(input_lens, axis=0)
+    else:
+        raise ValueError("mode must be 'fill' or 'discard', got {}".format(mode))
+
+    new_streams = []
+    for input_vec, target_vec, lens in zip(inputs, targets, input_lens):
+        index = segment_resize_index(lens, aligned_lens)
+        new_streams.append((np.take(input_vec, index, axis=0), np.take(target_vec, index, axis=0),
+                            aligned_lens.astype(lens.dtype)))
     return new_streams
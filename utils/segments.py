@@ -0,0 +1,159 @@
+"""
+Per-sequence operations on a data matrix of concatenated sequences.
+
+The data matrices hold the frames of all videos one after another, with a vector of video lengths
+describing where each video starts and ends. The functions below work on the whole matrix at once,
+using the segment offsets instead of a python loop over the videos.
+"""
+import numpy as np
+import scipy.sparse as sp
+
+
+def segment_offsets(seqlens):
+    """
+    compute the start offsets of the segments
+    :param seqlens: segment lengths
+    :return: array of len(seqlens) + 1 offsets, segment i spans rows offsets[i]:offsets[i + 1]
+    """
+    offsets = np.zeros(len(seqlens) + 1, dtype=np.int64)
+    np.cumsum(seqlens, out=offsets[1:])
+    return offsets
+
+
+def segment_ids(seqlens):
+    """
+    :param seqlens: segment lengths
+    :return: segment index of every row
+    """
+    return np.repeat(np.arange(len(seqlens)), seqlens)
+
+
+def segment_bounds(seqlens):
+    """
+    :param seqlens: segment lengths
+    :return: (first row, last row) of the segment of every row
+    """
+    offsets = segment_offsets(seqlens)
+    ids = segment_ids(seqlens)
+    return offsets[:-1][ids], offsets[1:][ids] - 1
+
+
+def segment_matrix(seqlens, dtype=np.float32):
+    """
+    :param seqlens: segment lengths
+    :param dtype: dtype of the matrix
+    :return: sparse (len(seqlens), sum(seqlens)) indicator matrix, entry (i, j) is 1 if row j belongs to segment i
+    """
+    n = int(np.sum(seqlens))
+    return sp.csr_matrix((np.ones(n, dtype=dtype), np.arange(n), segment_offsets(seqlens)),
+                         shape=(len(seqlens), n))
+
+
+def segment_sum(X, seqlens):
+    """
+    sum the rows of every segment
+    :param X: data matrix of concatenated segments of shape (rows, features)
+    :param seqlens: segment lengths
+    :return: matrix of shape (len(seqlens), features) with the segment sums, empty segments sum to 0
+    """
+    # a product with the segment indicator matrix sums the rows in one pass, np.add.reduceat
+    # along the row axis is several times slower than summing the segments one by one
+    return segment_matrix(seqlens, X.dtype if X.dtype.kind == 'f' else np.float32).dot(X)
+
+
+def segment_mean(X, seqlens):
+    """
+    average the rows of every segment
+    :param X: data matrix of concatenated segments of shape (rows, features)
+    :param seqlens: segment lengths
+    :return: matrix of shape (len(seqlens), features) with the segment means, empty segments average to 0
+    """
+    sums = segment_sum(X, seqlens)
+    sums /= np.maximum(np.asarray(seqlens), 1)[:, np.newaxis]
+    return sums
+
+
+def segment_shift(X, seqlens, k, first_pad=0, out=None):
+    """
+    shift the rows of every segment by k, row i of the result is row i + k of its segment.
+    rows shifted past the end of a segment repeat its last row, rows shifted before the start
+    repeat row first_pad of the segment (clipped to the segment)
+    :param X: data matrix of concatenated segments
+    :param seqlens: segment lengths
+    :param k: shift, positive to look ahead, negative to look back
+    :param first_pad: offset of the row repeated before the start of a segment
+    :param out: output array of the same shape as X
+    :return: shifted data matrix
+    """
+    out = np.empty_like(X) if out is None else out
+    n = len(X)
+    first, last = segment_bounds(seqlens)
+    rows = np.arange(n)
+    if k >= 0:
+        out[:n - k] = X[k:]
+        edge = np.flatnonzero(rows + k > last)
+        out[edge] = X[last[edge]]
+    else:
+        out[-k:] = X[:n + k]
+        edge = np.flatnonzero(rows + k < first)
+        out[edge] = X[np.minimum(first[edge] + first_pad, last[edge])]
+    return out
+
+
+def segment_deltas(X, seqlens, w=9, dtype=np.float32):
+    """
+    compute the deltas of every segment with a w-point linear slope, see preprocessing.deltas
+    :param X: data matrix of concatenated segments of shape (rows, features)
+    :param seqlens: segment lengths
+    :param w: window size
+    :param dtype: output dtype
+    :return: deltas of shape (rows, features)
+    """
+    hlen = w // 2
+    d = np.zeros(X.shape, dtype=dtype)
+    ahead = np.empty(X.shape, dtype=X.dtype)
+    behind = np.empty(X.shape, dtype=X.dtype)
+    for k in range(1, hlen + 1):
+        # deltas pads the start of a sequence with its 2nd frame, mirror it
+        segment_shift(X, seqlens, k, out=ahead)
+        segment_shift(X, seqlens, -k, first_pad=1, out=behind)
+        ahead -= behind
+        if k > 1:
+            ahead *= k
+        d += ahead
+    return d
+
+
+def segment_resize_index(seqlens, target_lens):
+    """
+    compute the gather index that resizes every segment to a target length, segments are cut
+    to a shorter target length and padded with their last row to a longer one
+    :param seqlens: segment lengths
+    :param target_lens: target segment lengths
+    :return: row index into the data matrix for every row of the resized data matrix
+    """
+    seqlens = np.asarray(seqlens)
+    target_lens = np.asarray(target_lens)
+    if np.any((seqlens == 0) & (target_lens > 0)):
+        raise ValueError('empty segments cannot be padded')
+    ids = segment_ids(target_lens)
+    positions = np.arange(len(ids)) - segment_offsets(target_lens)[:-1][ids]
+    return segment_offsets(seqlens)[:-1][ids] + np.minimum(positions, seqlens[ids] - 1)
+
+
+def segment_chunks(seqlens, chunksize=None):
+    """
+    group consecutive segments into chunks of about chunksize rows, segments are never split. a chunk
+    holds the segments starting within the same block of chunksize rows, so it can exceed chunksize
+    by the length of its last segment
+    :param seqlens: segment lengths
+    :param chunksize: number of rows per chunk, None puts all segments in one chunk
+    :return: list of (first segment, end segment) pairs
+    """
+    if len(seqlens) == 0:
+        return []
+    if not chunksize:
+        return [(0, len(seqlens))]
+    blocks = segment_offsets(seqlens)[:-1] // chunksize
+    bounds = np.concatenate([[0], np.flatnonzero(np.diff(blocks)) + 1, [len(seqlens)]])
+    return list(zip(bounds[:-1].tolist(), bounds[1:].tolist()))
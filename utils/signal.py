@@ -80,6 +80,48 @@ def append_delta_coeff(A, theta):
     return res
 
 
+def delta_matrix(seqlen, theta, dtype='float32'):
+    """
+    build the (time_step, time_step) linear operator equivalent to delta_coeff.
+    The edge padding is folded into the operator by clipping the shifted indices,
+    so applying it to a sequence gives the same result as the scan implementation.
+    :param seqlen: number of time steps (symbolic scalar)
+    :param theta: window size (symbolic or python scalar)
+    :param dtype: dtype of the returned operator
+    :return: delta operator D such that delta = D . A for A in shape (time_step, number_of_features)
+    """
+    t = T.arange(seqlen, dtype='int32')
+    k = T.arange(1, theta + 1, dtype='int32')
+    # indices of the forward and backward taps for every (time step, offset), clipped at the edges
+    fwd = T.clip(t.dimshuffle(0, 'x') + k.dimshuffle('x', 0), 0, seqlen - 1)
+    bwd = T.clip(t.dimshuffle(0, 'x') - k.dimshuffle('x', 0), 0, seqlen - 1)
+    weights = (1. / (2. * k)).astype(dtype)
+    # one-hot each tap over the time axis and weight it by 1 / (2 * offset)
+    taps = T.eq(fwd.dimshuffle(0, 1, 'x'), t.dimshuffle('x', 'x', 0)).astype(dtype) - \
+        T.eq(bwd.dimshuffle(0, 1, 'x'), t.dimshuffle('x', 'x', 0)).astype(dtype)
+    D = T.sum(taps * weights.dimshuffle('x', 0, 'x'), axis=1)
+    return D
+
+
+def append_delta_coeff_batch(X, theta):
+    """
+    append delta + acceleration coefficients to a batch of sequences without scan.
+    Equivalent to scanning append_delta_coeff over the batch.
+    :param X: input sequences in shape (batch_size, time_step, number_of_features)
+    :param theta: window size
+    :return: sequences with delta + acceleration coefficients appended to the feature axis
+    """
+    batchsize, seqlen, features = X.shape[0], X.shape[1], X.shape[2]
+    D = delta_matrix(seqlen, theta, X.dtype)
+    # acceleration is the delta of the delta, i.e. the operator applied twice
+    DD = T.concatenate([D, T.dot(D, D)], axis=0)
+    # move time to the first axis so both operators are applied with a single matmul
+    Y = X.dimshuffle(1, 0, 2).reshape((seqlen, batchsize * features))
+    deltas = T.dot(DD, Y).reshape((2, seqlen, batchsize, features)).dimshuffle(0, 2, 1, 3)
+    res = T.concatenate([X, deltas[0], deltas[1]], axis=2)
+    return res
+
+
 def main():
     """
     test runner, computes delta for an array of sequences
@@ -101,5 +143,11 @@ def main():
     res = compute_deltas(seqs, 1)
     print(res)
 
+    # compare against the closed-form batch implementation
+    compute_deltas_batch = theano.function([A, theta], outputs=append_delta_coeff_batch(A, theta))
+    for w in [1, 2, 3]:
+        diff = np.abs(compute_deltas(seqs, w) - compute_deltas_batch(seqs, w)).max()
+        print('window {}: max abs difference {}'.format(w, diff))
+
 if __name__ == '__main__':
     main()